@@ -2,37 +2,37 @@ import os
 import json
 import threading
 import time
-import io
 import re
-import wave
-import struct
+from functools import lru_cache
 from datetime import datetime
-from flask import Flask, render_template, request, jsonify, session
-import speech_recognition as sr
-from gtts import gTTS
-import playsound
-import nltk
-from nltk.tokenize import word_tokenize
-from nltk.corpus import stopwords
-import random
-import base64
+from flask import Flask, render_template, request, jsonify, session, g, url_for, abort, Response, stream_with_context
+from flask_sock import Sock
+from simple_websocket import ConnectionClosed
 from dotenv import load_dotenv
+from persistence import WriteAheadLog
+from storage import create_storage
+from catalog import CatalogIndex
+from recommender import CoOccurrence, history_baskets
+from suggestions import SuggestionContext
+from matcher import Automaton
+from fuzzy import FuzzyIndex, is_typo
+from search import CatalogSearch
+from tts import TTSCache
+from jobs import WorkerPool, JobStore
+import metrics
 
 # Load environment variables
 load_dotenv()
 
-try:
-    nltk.data.find('tokenizers/punkt')
-except LookupError:
-    nltk.download('punkt')
-    
-try:
-    nltk.data.find('corpora/stopwords')
-except LookupError:
-    nltk.download('stopwords')
+# Nothing at import time reads data files, builds indexes, loads the audio
+# stack or touches the network. create_app() loads the data; speech and audio
+# decoding are imported the first time a voice request needs them.
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', os.urandom(24))  
+# Base64 inflates audio by a third, so 10 MB of JSON is about 7.5 MB of audio.
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_UPLOAD_BYTES', str(10 * 1024 * 1024)))
+sock = Sock(app)
 
 NUMBER_WORDS = {
     "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
@@ -123,98 +123,280 @@ def init_shopping_data():
         with open(data_file, 'w') as f:
             json.dump(data, f, indent=4)
     
-    with open(data_file, 'r') as f:
-        return json.load(f)
+    return data_file
+
+# Built offline by `flask rebuild-recommendations`, then updated on every add.
+RECOMMENDATIONS_FILE = os.environ.get('RECOMMENDATIONS_FILE', 'data/recommendations.json')
+
+wal = None
+shopping_data = None
+storage = None
+catalog = None
+recommender = None
+suggestion_context = None
+_loaded = False
+_state_pid = None
+_init_lock = threading.Lock()
+
+def create_app(user_state=True):
+    """Load the catalog (once) and, unless user_state is False, user state.
+
+    gunicorn preloads the app with user_state=False, so the master builds only
+    the read-only catalog and its indexes and workers fork with them already in
+    memory. Each worker then loads user lists with load_user_state() (see
+    gunicorn.conf.py), so a respawned worker starts from what is on disk rather
+    than from the master's startup copy.
+    """
+    global catalog, recommender, _loaded
+    with _init_lock:
+        if not _loaded:
+            with open(init_shopping_data(), 'r') as f:
+                products = json.load(f)['products']
+            recommender = CoOccurrence()
+            recommender.load(RECOMMENDATIONS_FILE)
+            catalog = CatalogIndex(products)
+            get_command_matcher()
+            get_catalog_search()
+            _loaded = True
+    if user_state:
+        load_user_state()
+    return app
+
+def load_user_state():
+    """Load user lists from the snapshot and WAL, once per process."""
+    global wal, shopping_data, storage, suggestion_context, _state_pid
+    with _init_lock:
+        if _state_pid == os.getpid():
+            return
+        wal = WriteAheadLog(init_shopping_data())
+        shopping_data = wal.load()
+        
+        # 'memory' keeps users in shopping_data (journaled by the WAL) and only suits a
+        # single worker; 'sqlite' lets several gunicorn workers share user state.
+        storage = create_storage(os.environ.get('STORAGE_BACKEND', 'memory'), shopping_data, wal=wal,
+                                 sqlite_path=os.environ.get('SQLITE_PATH', 'data/shopping.db'))
+        suggestion_context = SuggestionContext(shopping_data, catalog)
+        _state_pid = os.getpid()
+
+@app.before_request
+def ensure_app_loaded():
+    # Covers servers that import app:app directly instead of calling create_app(),
+    # and workers forked without running gunicorn.conf.py's post_fork.
+    if not _loaded or _state_pid != os.getpid():
+        create_app()
+
+# Per-request timings: every metrics.span() on the request thread ends up in
+# the Server-Timing header. PROFILE_SAMPLE_RATE requests are also profiled.
+profiler = metrics.Profiler()
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.profile = profiler.start()
+    metrics.begin_request()
 
-shopping_data = init_shopping_data()
+@app.after_request
+def finish_request_metrics(response):
+    if 'request_started' not in g:
+        # A before_request hook failed before ours ran.
+        return response
+    elapsed = time.perf_counter() - g.request_started
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.REQUEST_SECONDS.observe(elapsed, endpoint=endpoint)
+    metrics.REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    response.headers['Server-Timing'] = metrics.server_timing(metrics.end_request(), elapsed)
+    return response
+
+@app.teardown_request
+def stop_request_profile(exc):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profiler.stop(profile, request.endpoint or 'unmatched')
+
+def set_catalog(products):
+    # Re-indexes only the products that were added, changed or removed.
+    shopping_data['products'] = products
+    catalog.sync(products)
+
+def set_sales(sales):
+    shopping_data['sales'] = sales
+    suggestion_context.invalidate()
 
-def init_user_session():
-    if 'user_id' not in session:
-        session['user_id'] = str(int(time.time() * 1000))
+def init_user_session(user_id=None):
+    # Background jobs pass the user explicitly since they have no session.
+    if user_id is None:
+        if 'user_id' not in session:
+            session['user_id'] = str(int(time.time() * 1000))
+        user_id = session['user_id']
     
-    user_id = session['user_id']
-    if user_id not in shopping_data['users']:
-        shopping_data['users'][user_id] = {
-            'shopping_list': [],
-            'history': [],
-            'preferences': {}
-        }
-        save_shopping_data()
+    storage.ensure_user(user_id)
+    return user_id
+
+# Multilingual support (basic)
+MULTILINGUAL_KEYWORDS = {
+    "add": ["add", "ajouter", "añadir", "hinzufügen", "添加", "追加"],
+    "remove": ["remove", "supprimer", "eliminar", "entfernen", "移除", "削除"],
+    "show": ["show", "afficher", "mostrar", "zeigen", "显示", "表示"],
+    "find": ["find", "trouver", "encontrar", "finden", "查找", "探す"],
+    "suggest": ["suggest", "suggerer", "sugerir", "vorschlagen", "建议", "提案"]
+}
+
+# English fallbacks, only used when no multilingual keyword matched
+ENGLISH_KEYWORDS = {
+    "add": ["add", "buy", "need", "want", "get"],
+    "remove": ["remove", "delete", "drop"],
+    "show": ["show", "list", "what's on"],
+    "find": ["find", "search", "look for"],
+    "suggest": ["suggest", "recommend"],
+    "clear": ["clear", "empty"]
+}
 
-def save_shopping_data():
-    with open('data/shopping_data.json', 'w') as f:
-        json.dump(shopping_data, f, indent=4)
+_keywords_version = 0
 
-def parse_quantity(text):
+def set_keywords(multilingual=None, english=None):
+    global _keywords_version
+    if multilingual is not None:
+        MULTILINGUAL_KEYWORDS.clear()
+        MULTILINGUAL_KEYWORDS.update(multilingual)
+    if english is not None:
+        ENGLISH_KEYWORDS.clear()
+        ENGLISH_KEYWORDS.update(english)
+    _keywords_version += 1
+
+def parser_version():
+    # Everything parse_command depends on: products, brands and types (all in
+    # the catalog) and the keyword tables.
+    return catalog.version, _keywords_version
+
+_command_matcher = None
+_command_matcher_version = None
+
+def get_command_matcher():
+    global _command_matcher, _command_matcher_version
+    if _command_matcher is not None and _command_matcher_version == parser_version():
+        return _command_matcher
+
+    # Intent spans carry (tier, order, intent) so min() reproduces the
+    # "multilingual first, then English in declaration order" precedence.
+    intents = {}
+    for tier, table in enumerate([MULTILINGUAL_KEYWORDS, ENGLISH_KEYWORDS]):
+        for order, (intent, keywords) in enumerate(table.items()):
+            for keyword in keywords:
+                value = (tier, order, intent)
+                intents[keyword] = min(intents.get(keyword, value), value)
+
+    automaton = Automaton()
+    for keyword, value in intents.items():
+        automaton.add(keyword, 'intent', value)
+    for word, value in NUMBER_WORDS.items():
+        automaton.add(word, 'quantity', value)
+    for name in catalog.by_name:
+        automaton.add(name, 'product', name)
+        if not name.endswith('s'):
+            automaton.add(name + 's', 'product', name)
+        for brand_key in catalog.brands(name):
+            automaton.add(brand_key, 'brand', brand_key)
+        for type_key in catalog.types(name):
+            automaton.add(type_key, 'type', type_key)
+
+    _command_matcher = automaton.build()
+    _command_matcher_version = parser_version()
+    return _command_matcher
+
+_fuzzy_index = None
+_fuzzy_index_version = None
+
+def get_fuzzy_index():
+    global _fuzzy_index, _fuzzy_index_version
+    if _fuzzy_index is None or _fuzzy_index_version != catalog.version:
+        _fuzzy_index = FuzzyIndex(catalog.by_name)
+        _fuzzy_index_version = catalog.version
+    return _fuzzy_index
+
+_catalog_search = None
+_catalog_search_version = None
+
+def get_catalog_search():
+    global _catalog_search, _catalog_search_version
+    if _catalog_search is None or _catalog_search_version != catalog.version:
+        _catalog_search = CatalogSearch(catalog, get_fuzzy_index())
+        _catalog_search_version = catalog.version
+    return _catalog_search
+
+def fuzzy_product(words):
+    # Score every run of up to three words in one batch, so "add some brad
+    # please" still finds bread; the best score wins, then the longer run.
+    # Runs that are a different word rather than a typo ("corn" for popcorn)
+    # never match.
+    phrases = [" ".join(words[i:j]) for i in range(len(words))
+               for j in range(i + 1, min(len(words), i + 3) + 1)]
+    best = None
+    for phrase, matches in zip(phrases, get_fuzzy_index().match_many(phrases, k=3)):
+        for name, score in matches:
+            if is_typo(phrase, name):
+                rank = (score, len(phrase))
+                if best is None or rank > best[0]:
+                    best = (rank, name)
+                break
+    return best[1] if best else None
+
+def parse_quantity(text, spans=None):
     m = re.search(r"(\d+)", text)
     if m:
         return int(m.group(1))
-    for w, v in NUMBER_WORDS.items():
-        if w in text:
-            return v
+    if spans is None:
+        spans = get_command_matcher().match(text)
+    for span in spans:
+        if span.kind == 'quantity':
+            return span.value
     return 1
 
+PARSE_CACHE_SIZE = int(os.environ.get('PARSE_CACHE_SIZE', '4096'))
+
+def normalize_command(command):
+    return " ".join(command.lower().split())
+
 def parse_command(command):
-    c = command.lower()
-    
-    # Multilingual support (basic)
-    multilingual_keywords = {
-        "add": ["add", "ajouter", "añadir", "hinzufügen", "添加", "追加"],
-        "remove": ["remove", "supprimer", "eliminar", "entfernen", "移除", "削除"],
-        "show": ["show", "afficher", "mostrar", "zeigen", "显示", "表示"],
-        "find": ["find", "trouver", "encontrar", "finden", "查找", "探す"],
-        "suggest": ["suggest", "suggerer", "sugerir", "vorschlagen", "建议", "提案"]
-    }
-    
-    # Check for multilingual commands
-    intent = "unknown"
-    for intent_key, keywords in multilingual_keywords.items():
-        if any(keyword in c for keyword in keywords):
-            intent = intent_key
-            break
+    # The same few phrases arrive over and over. Results depend only on the
+    # text and parser_version(), so a catalog or keyword change misses the
+    # cache instead of returning stale parses.
+    intent, item, qty, price_filter, brand, item_type, organic = _parse_cached(
+        normalize_command(command), parser_version())
+    # Cached results are shared; hand out a copy of the only mutable part.
+    return intent, item, qty, dict(price_filter) if price_filter else price_filter, brand, item_type, organic
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse_cached(c, version):
+    return parse_utterance(c)
+
+def parse_cache_stats():
+    info = _parse_cached.cache_info()
+    lookups = info.hits + info.misses
+    return {'hits': info.hits, 'misses': info.misses, 'size': info.currsize,
+            'max_size': info.maxsize, 'hit_rate': info.hits / lookups if lookups else 0.0}
+
+metrics.Gauge('parse_cache_hit_ratio', 'Share of parse_command calls answered from the cache.',
+              lambda: parse_cache_stats()['hit_rate'])
+
+def parse_utterance(c):
+    # Uncached parse of an already normalized command.
+    spans = get_command_matcher().match(c)
     
-    # If no multilingual match, try English
-    if intent == "unknown":
-        if "add" in c or "buy" in c or "need" in c or "want" in c or "get" in c:
-            intent = "add"
-        elif "remove" in c or "delete" in c or "drop" in c:
-            intent = "remove"
-        elif "show" in c or "list" in c or "what's on" in c:
-            intent = "show"
-        elif "find" in c or "search" in c or "look for" in c:
-            intent = "find"
-        elif "suggest" in c or "recommend" in c:
-            intent = "suggest"
-        elif "clear" in c or "empty" in c:
-            intent = "clear"
+    intents = [span.value for span in spans if span.kind == 'intent']
+    intent = min(intents)[2] if intents else "unknown"
     
     # Extract quantity
-    qty = parse_quantity(c)
+    qty = parse_quantity(c, spans)
     
     # Extract item with better matching
     item = None
     brand = None
     item_type = None
     
-    # First try exact matches with products
-    for category, products in shopping_data['products'].items():
-        for product in products:
-            product_name = product['name'] if isinstance(product, dict) else product
-            if product_name in c:
-                item = product_name
-                # Try to extract brand if available
-                if isinstance(product, dict) and 'brands' in product:
-                    for brand_option in product['brands']:
-                        if brand_option.lower() in c:
-                            brand = brand_option
-                # Try to extract type if available
-                if isinstance(product, dict) and 'types' in product:
-                    for type_option in product['types']:
-                        if type_option.lower() in c:
-                            item_type = type_option
-                break
-        if item:
-            break
+    # First try exact matches with products; the longest brand/type wins
+    products = [span for span in spans if span.kind == 'product']
+    if products:
+        item = products[0].value
     
     # If no exact match, try fuzzy matching
     if not item:
@@ -222,7 +404,16 @@ def parse_command(command):
                          "show", "list", "find", "search", "for", "my", "the", "shopping", "list"]
         words = [word for word in c.split() if word not in command_words and word not in NUMBER_WORDS]
         if words:
-            item = " ".join(words)
+            item = fuzzy_product(words) or " ".join(words)
+    
+    if catalog.lookup(item):
+        brands = catalog.brands(item)
+        types = catalog.types(item)
+        for span in sorted(spans, key=lambda s: s.end - s.start):
+            if span.kind == 'brand' and span.value in brands:
+                brand = brands[span.value]
+            elif span.kind == 'type' and span.value in types:
+                item_type = types[span.value]
     
     # Extract price filter
     price_filter = None
@@ -246,108 +437,269 @@ def parse_command(command):
     
     return intent, item, qty, price_filter, brand, item_type, organic
 
-def convert_audio_to_wav(audio_data):
-    try:
-        if isinstance(audio_data, str) and audio_data.startswith('data:audio/webm;base64,'):
-            audio_data = audio_data.split(',')[1]
-        
-        audio_bytes = base64.b64decode(audio_data)
+_decoder_pool = None
+_speech_service = None
+_speech_vocabulary_version = None
+_voice_lock = threading.Lock()
 
-        tmp_input = "temp_input.webm"
-        tmp_output = "temp_output.wav"
+def get_decoder_pool():
+    global _decoder_pool
+    with _voice_lock:
+        if _decoder_pool is None:
+            from audio import DecoderPool
+            _decoder_pool = DecoderPool()
+    return _decoder_pool
 
-        with open(tmp_input, "wb") as f:
-            f.write(audio_bytes)
+def get_speech_service():
+    global _speech_service
+    with _voice_lock:
+        if _speech_service is None:
+            from speech import create_speech_service
+            service = create_speech_service()
+            # Load models now rather than inside the first recognize() timeout.
+            service.warm()
+            _speech_service = service
+    return _speech_service
 
-        os.system(f"ffmpeg -i {tmp_input} -ar 16000 -ac 1 {tmp_output} -y")
+# Words that glue commands together but are not in any keyword table
+FILLER_WORDS = ["to", "my", "the", "from", "for", "of", "some", "me", "i", "please",
+                "shopping", "under", "below", "less", "than", "dollars", "and", "what's",
+                "on", "items", "organic"]
 
-        with open(tmp_output, "rb") as f:
-            wav_data = f.read()
+def build_speech_vocabulary():
+    phrases = set(FILLER_WORDS)
+    for table in (MULTILINGUAL_KEYWORDS, ENGLISH_KEYWORDS):
+        for keywords in table.values():
+            phrases.update(keywords)
+    phrases.update(NUMBER_WORDS)
+    for name in catalog.by_name:
+        phrases.add(name)
+        phrases.update(catalog.brands(name))
+        phrases.update(catalog.types(name))
+    return sorted(phrases)
 
-        os.remove(tmp_input)
-        os.remove(tmp_output)
+def refresh_speech_vocabulary():
+    global _speech_vocabulary_version
+    if _speech_vocabulary_version != parser_version():
+        get_speech_service().set_vocabulary(build_speech_vocabulary())
+        _speech_vocabulary_version = parser_version()
 
-        return wav_data
-    except Exception as e:
-        print(f"Audio conversion error: {e}")
-        return None
+# Trim silence and normalize loudness before recognition; silent and over-long
+# clips never reach the recognizer.
+AUDIO_PREPROCESS = os.environ.get('AUDIO_PREPROCESS', '1') == '1'
+
+# What recognize_speech returns instead of a transcript, and the reply to each
+STT_STATUS_REPLIES = {
+    "timeout": "I didn't catch that. Please try again.",
+    "unknown": "I didn't catch that. Please try again.",
+    "error": "I didn't catch that. Please try again.",
+    "silent": "I didn't hear anything. Please try again.",
+    "too_long": "That recording is too long. Please say one command at a time.",
+}
 
 def recognize_speech(audio_data=None):
-    recognizer = sr.Recognizer()
-    
-    try:
-        if audio_data:
-            try:
-                wav_data = convert_audio_to_wav(audio_data)
-                if wav_data:
-                    with sr.AudioFile(io.BytesIO(wav_data)) as source:
-                        audio = recognizer.record(source)
-                    text = recognizer.recognize_google(audio)
-                    print(f"Recognized: {text}")
-                    return text.lower()
-            except Exception as e:
-                print(f"Audio data processing failed: {e}")
-                
-                pass
-        
-        with sr.Microphone() as source:
-            print("Adjusting for ambient noise...")
-            recognizer.adjust_for_ambient_noise(source, duration=1)
-            print("Listening...")
-            audio = recognizer.listen(source, timeout=5, phrase_time_limit=5)
-        
-        print("Processing speech...")
-        text = recognizer.recognize_google(audio)
-        print(f"Recognized: {text}")
-        return text.lower()
-    except sr.WaitTimeoutError:
-        return "timeout"
-    except sr.UnknownValueError:
+    if not audio_data:
+        metrics.STT_FAILURES.inc(reason='empty')
         return "unknown"
-    except sr.RequestError as e:
-        print(f"Speech recognition error: {e}")
+    
+    from audio import TARGET_RATE, preprocess_pcm
+    with metrics.span('decode'):
+        pcm = get_decoder_pool().decode(audio_data)
+    if not pcm:
+        metrics.STT_FAILURES.inc(reason='decode')
         return "error"
-    except Exception as e:
-        print(f"Speech recognition failed: {e}")
-        return "Please check your microphone and try again."
+    if AUDIO_PREPROCESS:
+        with metrics.span('preprocess'):
+            pcm, rejected = preprocess_pcm(pcm, TARGET_RATE)
+        if rejected:
+            metrics.STT_FAILURES.inc(reason=rejected)
+            return rejected
+    refresh_speech_vocabulary()
+    with metrics.span('stt'):
+        command = get_speech_service().recognize(pcm, TARGET_RATE)
+    count_stt_failure(command)
+    return command
+
+def count_stt_failure(command):
+    if command in ("timeout", "unknown", "error"):
+        metrics.STT_FAILURES.inc(reason=command)
+
+tts_cache = TTSCache()
+
+# Stale replies are skipped: a reply nobody fetched within TTS_STALE_SECONDS is
+# synthesized on demand by /tts/<key>.mp3 instead.
+tts_pool = WorkerPool('tts', workers=int(os.environ.get('TTS_WORKERS', '2')),
+                      max_queue=int(os.environ.get('TTS_QUEUE_SIZE', '64')),
+                      stale_after=float(os.environ.get('TTS_STALE_SECONDS', '30')))
+
+# Replies common enough to synthesize before anyone asks for them
+COMMON_PHRASES = [
+    "Shopping list cleared.",
+    "I didn't catch that. Please try again.",
+    "Your shopping list is empty.",
+    "Please provide a command.",
+    "I'm not sure what you want to do. Try saying 'add milk' or 'what's on my list'.",
+    "Hello! How can I help with your shopping list today?",
+    "You're welcome! Is there anything else you need?",
+    "I don't have enough history to make suggestions yet.",
+    "I couldn't find any items matching your search."
+]
 
-def text_to_speech(text):
+metrics.Gauge('tts_queue_depth', 'Replies waiting for synthesis.', tts_pool.depth)
+
+def text_to_speech(key):
     try:
-        tts = gTTS(text=text, lang='en')
-        filename = f"audio_{int(time.time())}.mp3"
-        os.makedirs('audio', exist_ok=True)
-        filepath = os.path.join('audio', filename)
-        tts.save(filepath)
-        playsound.playsound(filepath)
-        threading.Thread(target=cleanup_audio, args=(filepath,)).start()
+        with metrics.span('tts'):
+            tts_cache.synthesize_key(key)
     except Exception as e:
         print(f"Text-to-speech error: {e}")
 
-def cleanup_audio(filepath):
-    time.sleep(2)  
-    try:
-        os.remove(filepath)
-    except:
-        pass
+def speak(text):
+    # The browser fetches the clip from /tts/<key>.mp3 once it is ready.
+    if g.get('speech_muted'):
+        # Batches speak one combined reply instead of one per command.
+        return None
+    if TTS_PREWARM and not _tts_prewarmed:
+        prewarm_tts()
+    key = tts_cache.register(text)
+    g.tts_key = key
+    tts_pool.submit(key, text_to_speech, key)
+    return key
+
+# Synthesizing needs the network, so the common phrases are queued on the first
+# reply a worker speaks rather than at startup.
+TTS_PREWARM = os.environ.get('TTS_PREWARM', '1') == '1'
+_tts_prewarmed = False
 
-def process_command(command):
-    if command in ["timeout", "unknown", "error"]:
-        return "I didn't catch that. Please try again."
+def prewarm_tts():
+    global _tts_prewarmed
+    _tts_prewarmed = True
+    for phrase in COMMON_PHRASES:
+        key = tts_cache.register(phrase)
+        tts_pool.submit(key, text_to_speech, key)
+
+# Separators between items in "add milk, two bread and eggs"
+COMPOUND_SEPARATOR = re.compile(r"\s*(?:,|;|&|\bthen\b|\band\b|\bplus\b)\s*")
+
+def split_compound_command(command):
+    c = command.lower()
+    spans = get_command_matcher().match(c)
+    intents = [span for span in spans if span.kind == 'intent']
+    if not intents:
+        return [command]
+    first = min(intents, key=lambda span: span.value)
+    if first.value[2] not in ("add", "remove"):
+        return [command]
     
-    intent, item, qty, price_filter, brand, item_type, organic = parse_command(command)
+    # Never split inside a catalog name such as "Ben & Jerry's".
+    protected = [(span.start, span.end) for span in spans
+                 if span.kind in ('product', 'brand', 'type')]
+    parts = []
+    start = 0
+    for m in COMPOUND_SEPARATOR.finditer(c):
+        if any(s < m.end() and m.start() < e for s, e in protected):
+            continue
+        parts.append(c[start:m.start()])
+        start = m.end()
+    parts.append(c[start:])
+    parts = [part.strip() for part in parts if part.strip()]
+    if len(parts) < 2:
+        return [command]
+    
+    # Later parts without their own verb reuse the first one ("two bread" -> "add two bread").
+    keyword = c[first.start:first.end]
+    matcher = get_command_matcher()
+    commands = [parts[0]]
+    for part in parts[1:]:
+        if any(span.kind == 'intent' for span in matcher.match(part)):
+            commands.append(part)
+        else:
+            commands.append(f"{keyword} {part}")
+    return commands
+
+def process_command(command, user_id=None):
+    if command in STT_STATUS_REPLIES:
+        return STT_STATUS_REPLIES[command]
+    
+    commands = split_compound_command(command)
+    if len(commands) > MAX_BATCH_COMMANDS:
+        return TOO_MANY_COMMANDS
+    if len(commands) > 1:
+        response, _ = process_batch(commands, user_id=user_id)
+        return response
+    return process_single_command(command, user_id=user_id)
+
+# A batch holds the user's lock (or a SQLite write transaction) until it is done.
+MAX_BATCH_COMMANDS = int(os.environ.get('MAX_BATCH_COMMANDS', '50'))
+TOO_MANY_COMMANDS = f"Please send at most {MAX_BATCH_COMMANDS} items at a time."
+
+INVALID_BATCH_ITEM = "Invalid item: send a command or an object with an action and a name."
+
+def valid_batch_entry(entry):
+    if isinstance(entry, str):
+        return True
+    if not isinstance(entry, dict):
+        return False
+    return (isinstance(entry.get('action'), str) and isinstance(entry.get('name'), str) and
+            all(isinstance(entry.get(field), (str, type(None))) for field in ('brand', 'type')))
+
+def process_batch(entries, user_id=None):
+    # Entries are command strings or {"action", "name", "quantity", ...} dicts.
+    # All of them are applied in one storage transaction and spoken as one reply.
+    user_id = init_user_session(user_id)
+    results = []
+    g.speech_muted = True
+    try:
+        with storage.batch(user_id):
+            for entry in entries:
+                if not valid_batch_entry(entry):
+                    response = INVALID_BATCH_ITEM
+                elif isinstance(entry, dict):
+                    response = apply_batch_item(entry, user_id)
+                else:
+                    response = process_single_command(entry.lower(), user_id=user_id)
+                results.append({'command': entry, 'response': response})
+    finally:
+        g.speech_muted = False
+    
+    response = " ".join(result['response'] for result in results)
+    if results:
+        speak(response)
+    return response, results
+
+def apply_batch_item(entry, user_id):
+    action = entry.get('action')
+    name = entry['name'].lower()
+    if action == 'add':
+        try:
+            quantity = int(entry.get('quantity', 1))
+        except (TypeError, ValueError):
+            return f"Invalid quantity for {name}."
+        if quantity < 1:
+            return f"Invalid quantity for {name}."
+        return add_item(name, quantity, entry.get('brand'), entry.get('type'),
+                        bool(entry.get('organic', False)), user_id=user_id)
+    elif action == 'remove':
+        return remove_item(name, user_id=user_id)
+    return f"Unknown action: {action}."
+
+def process_single_command(command, user_id=None):
+    with metrics.span('parse'):
+        intent, item, qty, price_filter, brand, item_type, organic = parse_command(command)
+    metrics.COMMANDS.inc(intent=intent)
     
     if intent == "add" and item:
-        return add_item(item, qty, brand, item_type, organic)
+        return add_item(item, qty, brand, item_type, organic, user_id=user_id)
     elif intent == "remove" and item:
-        return remove_item(item)
+        return remove_item(item, user_id=user_id)
     elif intent == "show":
-        return get_shopping_list()
+        return get_shopping_list(user_id=user_id)
     elif intent == "find" and item:
         return search_items(item, price_filter, brand, item_type, organic)
     elif intent == "suggest":
-        return suggest_items()
+        return suggest_items(user_id=user_id)
     elif intent == "clear":
-        return clear_list()
+        return clear_list(user_id=user_id)
     elif intent == "unknown":
         if any(word in command for word in ["hello", "hi", "hey", "greetings"]):
             return "Hello! How can I help with your shopping list today?"
@@ -359,9 +711,8 @@ def process_command(command):
     
     return "I'm not sure what you want to do. Try saying 'add milk' or 'what's on my list'."
 
-def add_item(item_name, quantity, brand=None, item_type=None, organic=False):
-    init_user_session()
-    user_id = session['user_id']
+def add_item(item_name, quantity, brand=None, item_type=None, organic=False, user_id=None):
+    user_id = init_user_session(user_id)
     
     if not item_name:
         return "What would you like to add to your shopping list?"
@@ -370,31 +721,11 @@ def add_item(item_name, quantity, brand=None, item_type=None, organic=False):
     category = "uncategorized"
     product_details = {}
     
-    for cat, products in shopping_data['products'].items():
-        for product in products:
-            product_name = product['name'] if isinstance(product, dict) else product
-            if product_name == item_name:
-                category = cat
-                if isinstance(product, dict):
-                    product_details = product.copy()
-                break
-        if category != "uncategorized":
-            break
+    match = catalog.lookup(item_name)
+    if match:
+        category, product_details = match
     
-    # Check if item is already in list
-    shopping_list = shopping_data['users'][user_id]['shopping_list']
-    for item in shopping_list:
-        if (item['name'] == item_name and 
-            item.get('brand') == brand and 
-            item.get('type') == item_type and
-            item.get('organic') == organic):
-            item['quantity'] += quantity
-            save_shopping_data()
-            response = f"Updated quantity of {format_item_name(item)} to {item['quantity']}."
-            threading.Thread(target=text_to_speech, args=(response,)).start()
-            return response
-    
-    # Add new item
+    # Add new item (or merge into an existing line with the same variant)
     new_item = {
         'name': item_name,
         'quantity': quantity,
@@ -409,17 +740,21 @@ def add_item(item_name, quantity, brand=None, item_type=None, organic=False):
     if 'price' in product_details:
         new_item['price'] = product_details['price']
     
-    shopping_data['users'][user_id]['shopping_list'].append(new_item)
+    item, merged = storage.add_item(user_id, new_item)
+    if merged:
+        response = f"Updated quantity of {format_item_name(item)} to {item['quantity']}."
+        speak(response)
+        return response
     
     # Add to history
     history_item = new_item.copy()
     history_item['added_on'] = datetime.now().isoformat()
-    shopping_data['users'][user_id]['history'].append(history_item)
+    storage.add_history(user_id, history_item)
     
-    save_shopping_data()
-    
-    # Generate suggestions
-    suggestions = generate_suggestions(item_name)
+    # Learn what this item is bought with, then generate suggestions
+    shopping_list = storage.get_shopping_list(user_id)
+    recommender.observe(item_name, [line['name'] for line in shopping_list])
+    suggestions = generate_suggestions(item_name, user_id=user_id, shopping_list=shopping_list)
     
     # Check for sales
     sale_info = check_for_sales(item_name)
@@ -430,7 +765,7 @@ def add_item(item_name, quantity, brand=None, item_type=None, organic=False):
     if suggestions:
         response += f" You might also need: {', '.join(suggestions[:3])}."
     
-    threading.Thread(target=text_to_speech, args=(response,)).start()
+    speak(response)
     
     return response
 
@@ -446,32 +781,22 @@ def format_item_name(item):
     return " ".join(name_parts)
 
 def check_for_sales(item_name):
-    for sale in shopping_data.get('sales', {}).get('current', []):
-        if sale['item'] == item_name:
-            return f"On sale: {sale['discount']*100}% off until {sale['until']}!"
+    sale = suggestion_context.get().sales.get(item_name)
+    if sale:
+        return f"On sale: {sale['discount']*100}% off until {sale['until']}!"
     return None
 
-def remove_item(item_name):
-    init_user_session()
-    user_id = session['user_id']
+def remove_item(item_name, user_id=None):
+    user_id = init_user_session(user_id)
     
     if not item_name:
         return "What would you like to remove from your shopping list?"
     
-    shopping_list = shopping_data['users'][user_id]['shopping_list']
-    removed = False
-    removed_item = None
-    
-    for i, item in enumerate(shopping_list):
-        if item_name == item['name']:
-            removed_item = shopping_list.pop(i)
-            removed = True
-            break
+    removed = storage.remove_item(user_id, item_name)
     
     if removed:
-        save_shopping_data()
-        response = f"Removed {removed_item['name']} from your shopping list."
-        threading.Thread(target=text_to_speech, args=(response,)).start()
+        response = f"Removed {removed[0]['name']} from your shopping list."
+        speak(response)
         return response
     else:
         return f"I couldn't find {item_name} in your shopping list."
@@ -480,47 +805,31 @@ def search_items(item_name, price_filter=None, brand=None, item_type=None, organ
     if not item_name:
         return "What would you like me to search for?"
     
+    price_filter = price_filter or {}
+    found = get_catalog_search().search(
+        item_name, brands=[brand] if brand else (), types=[item_type] if item_type else (),
+        organic=organic, min_price=price_filter.get('min'), max_price=price_filter.get('max'),
+        per_page=5)
+    
     results = []
-    for category, products in shopping_data['products'].items():
-        for product in products:
-            product_name = product['name'] if isinstance(product, dict) else product
-            
-            # Check if product matches search criteria
-            matches = item_name in product_name
-            if brand and isinstance(product, dict) and 'brands' in product:
-                matches = matches and brand in product['brands']
-            if item_type and isinstance(product, dict) and 'types' in product:
-                matches = matches and item_type in product['types']
-            if organic:
-                matches = matches and "organic" in product_name.lower()
-            
-            # Check price filter
-            if matches and price_filter and isinstance(product, dict) and 'price' in product:
-                price = product['price']
-                if 'max' in price_filter and price > price_filter['max']:
-                    matches = False
-                if 'min' in price_filter and price < price_filter['min']:
-                    matches = False
-            
-            if matches:
-                result = product_name
-                if isinstance(product, dict) and 'price' in product:
-                    result += f" (${product['price']})"
-                results.append(result)
+    for product in found['results']:
+        result = product['name']
+        if 'price' in product:
+            result += f" (${product['price']})"
+        results.append(result)
     
     if results:
-        response = f"I found {len(results)} items: {', '.join(results[:5])}."
-        if len(results) > 5:
-            response += f" And {len(results) - 5} more."
+        response = f"I found {found['total']} items: {', '.join(results)}."
+        if found['total'] > 5:
+            response += f" And {found['total'] - 5} more."
         return response
     else:
         return "I couldn't find any items matching your search."
     
-def get_shopping_list():
-    init_user_session()
-    user_id = session['user_id']
+def get_shopping_list(user_id=None):
+    user_id = init_user_session(user_id)
     
-    shopping_list = shopping_data['users'][user_id]['shopping_list']
+    shopping_list = storage.get_shopping_list(user_id)
     
     if not shopping_list:
         return "Your shopping list is empty."
@@ -536,106 +845,265 @@ def get_shopping_list():
     for category, items in categorized.items():
         response += f"{category}: {', '.join(items)}. "
     
-    threading.Thread(target=text_to_speech, args=(response,)).start()
+    speak(response)
     
     return response
 
-def suggest_items():
-    init_user_session()
-    user_id = session['user_id']
+def suggest_items(user_id=None):
+    user_id = init_user_session(user_id)
     
-    history = shopping_data['users'][user_id]['history']
-    if not history:
-        return "I don't have enough history to make suggestions yet."
-    
-
-    recent_items = [item['name'] for item in history[-3:]] if len(history) >= 3 else []
+    on_list = {item['name'] for item in storage.get_shopping_list(user_id)}
+    recent_items = regular_items(user_id, 3, exclude=on_list)
     
     if recent_items:
         response = f"Based on your history, you might need: {', '.join(recent_items)}."
-        threading.Thread(target=text_to_speech, args=(response,)).start()
+        speak(response)
         return response
     else:
         return "I don't have enough history to make suggestions yet."
 
 
-def clear_list():
-    init_user_session()
-    user_id = session['user_id']
-    shopping_data['users'][user_id]['shopping_list'] = []
-    save_shopping_data()
+def regular_items(user_id, limit, exclude=()):
+    """Names the user buys most, putting items due again by their usual interval first."""
+    now = time.time()
+    ranked = []
+    for name, stats in storage.get_item_stats(user_id).items():
+        if name in exclude:
+            continue
+        overdue = 0.0
+        if stats['avg_interval'] and stats['last_bought']:
+            elapsed = now - datetime.fromisoformat(stats['last_bought']).timestamp()
+            overdue = elapsed / stats['avg_interval']
+        ranked.append((overdue >= 1, stats['count'], overdue, name))
+    ranked.sort(reverse=True)
+    return [name for *_, name in ranked[:limit]]
+
+
+def clear_list(user_id=None):
+    user_id = init_user_session(user_id)
+    storage.clear_list(user_id)
     
     response = "Shopping list cleared."
-    threading.Thread(target=text_to_speech, args=(response,)).start()
+    speak(response)
     
     return response
 
 
-def generate_suggestions(item_name):
-    init_user_session()
-    user_id = session['user_id']
+def generate_suggestions(item_name, user_id=None, shopping_list=None):
+    if user_id is None:
+        user_id = init_user_session()
+    if shopping_list is None:
+        shopping_list = storage.get_shopping_list(user_id)
     
+    # Best candidates first; duplicates and items already on the list are
+    # dropped below without losing that order.
     suggestions = []
     
+    # Items frequently bought together with this one
+    suggestions.extend(recommender.related(item_name))
+    
     # Substitute suggestions
     for product, substitutes in shopping_data['substitutes'].items():
         if product in item_name:
             suggestions.extend(substitutes)
     
-    # Category-based suggestions
-    user_categories = set()
-    for item in shopping_data['users'][user_id]['shopping_list']:
-        user_categories.add(item['category'])
+    # History-based suggestions: what the user buys regularly and is due for
+    suggestions.extend(regular_items(user_id, 5, exclude={item_name}))
     
-    for category in user_categories:
-        if category in shopping_data['products']:
-            category_items = [item['name'] if isinstance(item, dict) else item 
-                             for item in shopping_data['products'][category]]
-            suggestions.extend(random.sample(category_items, min(2, len(category_items))))
+    context = suggestion_context.get()
     
     # Seasonal suggestions
-    current_month = datetime.now().month
-    if current_month in [12, 1, 2]:
-        season = "winter"
-    elif current_month in [3, 4, 5]:
-        season = "spring"
-    elif current_month in [6, 7, 8]:
-        season = "summer"
-    else:
-        season = "fall"
+    suggestions.extend(context.seasonal_items)
     
-    suggestions.extend(shopping_data['seasonal_items'][season])
+    # Sales suggestions (expired sales are already left out)
+    suggestions.extend(context.sale_suggestions)
     
-    # History-based suggestions (items frequently bought together)
-    history = shopping_data['users'][user_id].get('history', [])
-    if history:
-        # Simple algorithm: suggest items that were often added around the same time
-        recent_items = [item['name'] for item in history[-5:]] if len(history) >= 5 else []
-        suggestions.extend(recent_items)
+    # Category-based suggestions
+    user_categories = {}
+    for item in shopping_list:
+        user_categories.setdefault(item['category'], None)
     
-    # Sales suggestions
-    for sale in shopping_data.get('sales', {}).get('current', []):
-        suggestions.append(sale['item'] + " (on sale!)")
+    for category in user_categories:
+        suggestions.extend(context.category_names.get(category, ())[:2])
     
-    suggestions = list(set(suggestions))
-    if item_name in suggestions:
-        suggestions.remove(item_name)
+    seen = {item['name'] for item in shopping_list}
+    seen.add(item_name)
+    unique = []
+    for suggestion in suggestions:
+        if suggestion not in seen:
+            seen.add(suggestion)
+            unique.append(suggestion)
+            if len(unique) == 5:
+                break
     
-    return suggestions[:5]
+    return unique
+
+
+@app.cli.command('rebuild-recommendations')
+def rebuild_recommendations():
+    """Rebuild the co-occurrence matrix from every user's list and history."""
+    create_app()
+    baskets = []
+    for user_id in storage.user_ids():
+        baskets.append([item['name'] for item in storage.get_shopping_list(user_id)])
+        baskets.extend(history_baskets(storage.get_history(user_id)))
+    recommender.rebuild(baskets)
+    recommender.save(RECOMMENDATIONS_FILE)
+    print(f"Rebuilt recommendations for {len(recommender.counts)} items from {len(baskets)} baskets")
 
 @app.route('/')
 def index():
     init_user_session()
-    return render_template('index.html')
+    return render_template('index.html', live_list_sync=LIVE_LIST_SYNC)
+
+# Asynchronous voice commands: POST returns a job id straight away and the
+# decode -> recognize -> process pipeline runs on voice_pool.
+voice_jobs = JobStore(ttl=float(os.environ.get('VOICE_JOB_TTL', '300')))
+
+def fail_voice_job(job_id):
+    voice_jobs.update(job_id, status='failed', error="The server is busy. Please try again.")
+
+voice_pool = WorkerPool('voice', workers=int(os.environ.get('VOICE_WORKERS', '4')),
+                        max_queue=int(os.environ.get('VOICE_QUEUE_SIZE', '32')),
+                        on_drop=fail_voice_job)
+metrics.Gauge('voice_queue_depth', 'Voice commands waiting for a worker.', voice_pool.depth)
+
+def run_voice_job(job_id, audio_data, user_id):
+    with app.app_context():
+        try:
+            voice_jobs.update(job_id, status='transcribing')
+            command = recognize_speech(audio_data)
+            voice_jobs.update(job_id, status='processing', transcript=command)
+            response = process_command(command, user_id=user_id)
+            voice_jobs.update(job_id, status='done', response=response,
+                              tts_key=g.pop('tts_key', None))
+        except Exception as e:
+            print(f"Voice job {job_id} failed: {e}")
+            voice_jobs.update(job_id, status='failed', error="Sorry, something went wrong.")
+
+def voice_job_payload(job):
+    payload = {key: job[key] for key in ('id', 'status', 'transcript', 'response', 'error')
+               if job.get(key) is not None}
+    if job.get('tts_key'):
+        payload['audio_url'] = url_for('tts_audio', key=job['tts_key'])
+    return payload
+
+def get_user_job(job_id):
+    job = voice_jobs.get(job_id)
+    if job is None or job['user_id'] != init_user_session():
+        abort(404)
+    return job
+
+def command_response(response):
+    payload = {'response': response}
+    key = g.pop('tts_key', None)
+    if key:
+        payload['audio_url'] = url_for('tts_audio', key=key)
+    return jsonify(payload)
+
+@app.errorhandler(413)
+def upload_too_large(e):
+    return jsonify({'response': "That recording is too large."}), 413
 
 @app.route('/voice-command', methods=['POST'])
 def voice_command():
     data = request.get_json()
     audio_data = data.get("audio") if data else None
 
+    if (data and data.get('async')) or request.args.get('async') == '1':
+        user_id = init_user_session()
+        job_id = voice_jobs.create(user_id=user_id)
+        voice_pool.submit(job_id, run_voice_job, job_id, audio_data, user_id)
+        return jsonify({
+            'job_id': job_id,
+            'status_url': url_for('voice_job', job_id=job_id),
+            'events_url': url_for('voice_job_events', job_id=job_id)
+        }), 202
+
     command = recognize_speech(audio_data)
     response = process_command(command)
-    return jsonify({'response': response})
+    return command_response(response)
+
+@app.route('/voice-jobs/<job_id>', methods=['GET'])
+def voice_job(job_id):
+    return jsonify(voice_job_payload(get_user_job(job_id)))
+
+@app.route('/voice-jobs/<job_id>/events', methods=['GET'])
+def voice_job_events(job_id):
+    get_user_job(job_id)
+
+    def stream():
+        # The transcript is sent as soon as recognition finishes, before the
+        # command itself has been processed.
+        version = None
+        sent_transcript = False
+        while True:
+            job, version = voice_jobs.wait(job_id, version, 15)
+            if job is None:
+                return
+            payload = voice_job_payload(job)
+            if 'transcript' in payload and not sent_transcript:
+                sent_transcript = True
+                yield f"event: transcript\ndata: {json.dumps(payload)}\n\n"
+            if job['status'] in ('done', 'failed'):
+                yield f"event: {job['status']}\ndata: {json.dumps(payload)}\n\n"
+                return
+            yield ": keep-alive\n\n"
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@sock.route('/voice-stream')
+def voice_stream(ws):
+    # Protocol: the client sends 16 kHz mono s16le PCM as binary frames and
+    # may send {"type": "stop"} as text; the server replies with JSON messages
+    # of type partial, intent, final and response.
+    from audio import EndpointDetector, TARGET_RATE
+    from speech import StablePrefix
+    
+    user_id = init_user_session()
+    refresh_speech_vocabulary()
+    speech_service = get_speech_service()
+    stream = speech_service.open_stream(TARGET_RATE)
+    endpoint = EndpointDetector(TARGET_RATE)
+    stable = StablePrefix()
+    last_partial = None
+    announced = None
+
+    try:
+        while True:
+            message = ws.receive(timeout=endpoint.max_ms / 1000)
+            if message is None or isinstance(message, str):
+                break
+            partial = stream.accept(message)
+            if partial != last_partial:
+                last_partial = partial
+                ws.send(json.dumps({'type': 'partial', 'transcript': partial}))
+
+                # Run the parser on the part of the partial that has stopped
+                # changing, so clients can confirm e.g. "add milk" early.
+                prefix = stable.update(partial)
+                if prefix:
+                    intent, item, qty = parse_command(prefix)[:3]
+                    if intent != "unknown" and (intent, item, qty) != announced:
+                        announced = (intent, item, qty)
+                        ws.send(json.dumps({'type': 'intent', 'intent': intent,
+                                            'item': item, 'quantity': qty}))
+            if endpoint.accept(message):
+                break
+
+        with metrics.span('stt'):
+            command = speech_service.finish_stream(stream)
+        count_stt_failure(command)
+        ws.send(json.dumps({'type': 'final', 'transcript': command}))
+        response = process_command(command, user_id=user_id)
+        payload = {'type': 'response', 'response': response}
+        key = g.pop('tts_key', None)
+        if key:
+            payload['audio_url'] = url_for('tts_audio', key=key)
+        ws.send(json.dumps(payload))
+    except ConnectionClosed:
+        pass
 
 @app.route('/text-command', methods=['POST'])
 def text_command():
@@ -646,21 +1114,130 @@ def text_command():
         return jsonify({'response': "Please provide a command."})
     
     response = process_command(command)
-    return jsonify({'response': response})
+    return command_response(response)
+
+@app.route('/batch-command', methods=['POST'])
+def batch_command():
+    data = request.get_json()
+    if not isinstance(data, dict):
+        return jsonify({'response': "Please provide a list of commands."}), 400
+    entries = data.get('commands')
+    if entries is None and isinstance(data.get('command'), str) and data['command']:
+        entries = split_compound_command(data['command'].lower())
+    if not entries or not isinstance(entries, list):
+        return jsonify({'response': "Please provide a list of commands."}), 400
+    if len(entries) > MAX_BATCH_COMMANDS:
+        return jsonify({'response': TOO_MANY_COMMANDS}), 400
+    
+    response, results = process_batch(entries)
+    payload = {'response': response, 'results': results}
+    key = g.pop('tts_key', None)
+    if key:
+        payload['audio_url'] = url_for('tts_audio', key=key)
+    return jsonify(payload)
+
+@app.route('/search', methods=['GET'])
+def search():
+    args = request.args
+    try:
+        found = get_catalog_search().search(
+            args.get('q'),
+            categories=args.getlist('category'),
+            brands=args.getlist('brand'),
+            types=args.getlist('type'),
+            organic=args.get('organic') in ('1', 'true'),
+            min_price=args.get('min_price', type=float),
+            max_price=args.get('max_price', type=float),
+            sort=args.get('sort', 'relevance'),
+            page=args.get('page', 1, type=int),
+            per_page=args.get('per_page', 10, type=int))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(found)
+
+def list_payload(user_id, since=None):
+    # Only what changed after since when storage can still tell, else the full list.
+    if since is not None:
+        changes = storage.get_list_changes(user_id, since)
+        if changes is not None:
+            return dict(changes, since=since)
+    version, lines = storage.get_versioned_list(user_id)
+    return {'version': version, 'shopping_list': lines}
 
 @app.route('/shopping-list', methods=['GET'])
 def get_list():
-    init_user_session()
-    user_id = session['user_id']
-    return jsonify({'shopping_list': shopping_data['users'][user_id]['shopping_list']})
+    user_id = init_user_session()
+    etag = f"list-{storage.get_list_version(user_id)}"
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        payload = list_payload(user_id, request.args.get('since', type=int))
+        response = jsonify(payload)
+        etag = f"list-{payload['version']}"
+    # The list is per user, so caches must key on the session cookie and
+    # revalidate every time.
+    response.set_etag(etag)
+    response.vary.add('Cookie')
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+# Each request waits for at most one change, so it holds a worker thread for
+# no longer than LIST_EVENTS_TIMEOUT; EventSource then reconnects on its own.
+LIST_EVENTS_TIMEOUT = float(os.environ.get('LIST_EVENTS_TIMEOUT', '25'))
+LIST_EVENTS_RETRY_MS = int(os.environ.get('LIST_EVENTS_RETRY_MS', '1000'))
+# Off by default: every open page would keep a thread busy.
+LIVE_LIST_SYNC = os.environ.get('LIVE_LIST_SYNC', '0') == '1'
+
+@app.route('/shopping-list/events', methods=['GET'])
+def shopping_list_events():
+    user_id = init_user_session()
+    # On reconnect EventSource sends the last id it saw, which is newer than
+    # the since= it was first opened with.
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('since', type=int)
+
+    body = f"retry: {LIST_EVENTS_RETRY_MS}\n"
+    if since is not None and storage.wait_for_list_change(user_id, since, LIST_EVENTS_TIMEOUT) == since:
+        body += ": no change\n\n"
+    else:
+        payload = list_payload(user_id, since)
+        body += f"id: {payload['version']}\nevent: list\ndata: {json.dumps(payload)}\n\n"
+    return Response(body, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/clear-list', methods=['POST'])
 def clear_list_route():
-    return jsonify({'response': clear_list()})
+    return command_response(clear_list())
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    return jsonify({'tts_cache': tts_cache.stats(), 'tts_queue': tts_pool.stats(),
+                    'parse_cache': parse_cache_stats()})
+
+@app.route('/metrics', methods=['GET'])
+def metrics_route():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/tts/<key>.mp3')
+def tts_audio(key):
+    # Keys are content hashes, so a matching ETag means the clip is unchanged.
+    if key in request.if_none_match:
+        return Response(status=304)
+    with metrics.span('tts'):
+        data = tts_cache.synthesize_key(key)
+    if data is None:
+        abort(404)
+    response = Response(data, mimetype='audio/mpeg')
+    response.set_etag(key)
+    response.cache_control.public = True
+    response.cache_control.max_age = 86400
+    return response
 
 if __name__ == '__main__':
     if not os.path.exists('audio'):
         os.makedirs('audio')
     if not os.path.exists('data'):
         os.makedirs('data')
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    create_app().run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
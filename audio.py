@@ -0,0 +1,244 @@
+import io
+import os
+import wave
+import base64
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+try:
+    import av
+except ImportError:
+    av = None
+
+# Decode uploaded audio to 16 kHz mono 16-bit PCM entirely in memory.
+#
+# WebM/Opus and other containers are decoded in-process with PyAV. Without
+# PyAV we fall back to ffmpeg over pipes, which still avoids the shell and
+# shared temp files. WAV uploads that are already in the target format and raw
+# PCM skip decoding altogether; other 16-bit WAVs are downmixed and resampled
+# with NumPy.
+#
+# preprocess_pcm() then trims leading and trailing silence, normalizes
+# loudness and rejects silent or over-long clips, so the recognizer gets less
+# and more uniform audio.
+
+TARGET_RATE = 16000
+SAMPLE_WIDTH = 2
+DECODER_WORKERS = int(os.environ.get('AUDIO_DECODER_WORKERS', '2'))
+DECODE_TIMEOUT = float(os.environ.get('AUDIO_DECODE_TIMEOUT', '10'))
+MAX_AUDIO_SECONDS = float(os.environ.get('MAX_AUDIO_SECONDS', '30'))
+VAD_FRAME_MS = 30
+VAD_MIN_RMS = float(os.environ.get('VAD_MIN_RMS', '200'))
+VAD_PADDING_MS = int(os.environ.get('VAD_PADDING_MS', '300'))
+TARGET_RMS = float(os.environ.get('AUDIO_TARGET_RMS', '3000'))  # about -21 dBFS
+MAX_GAIN = 10.0
+
+
+# Raw 16 kHz mono s16le has no header to sniff, so it is only accepted when
+# the upload says so with its data-URL type, e.g. data:audio/l16;base64,...
+RAW_PCM_TYPES = ('audio/l16', 'audio/pcm', 'audio/x-raw')
+
+
+def decode_base64(audio_data):
+    """Returns (bytes, MIME type); the type is None unless sent as a data URL."""
+    mime_type = None
+    if isinstance(audio_data, str) and audio_data.startswith('data:'):
+        header, audio_data = audio_data.split(',', 1)
+        mime_type = header[5:].split(';', 1)[0].strip().lower() or None
+    return base64.b64decode(audio_data), mime_type
+
+
+def sniff_format(audio_bytes, mime_type=None):
+    if mime_type in RAW_PCM_TYPES:
+        return 'pcm'
+    if audio_bytes[:4] == b'RIFF' and audio_bytes[8:12] == b'WAVE':
+        return 'wav'
+    if audio_bytes[:4] == b'\x1a\x45\xdf\xa3':
+        return 'webm'
+    if audio_bytes[:4] == b'OggS':
+        return 'ogg'
+    if audio_bytes[4:8] == b'ftyp':
+        return 'mp4'
+    if audio_bytes[:3] == b'ID3' or (len(audio_bytes) > 1 and audio_bytes[0] == 0xff
+                                     and audio_bytes[1] & 0xe0 == 0xe0):
+        return 'mpeg'  # MP3, or AAC in ADTS frames
+    return None
+
+
+def resample(samples, rate, target=TARGET_RATE):
+    if rate == target or not len(samples):
+        return samples
+    factor = int(rate // target)
+    if factor > 1:
+        # Moving average over the decimation factor as a cheap anti-aliasing filter.
+        samples = np.convolve(samples, np.ones(factor) / factor, mode='same')
+    positions = np.arange(int(len(samples) * target / rate)) * (rate / target)
+    return np.interp(positions, np.arange(len(samples)), samples)
+
+
+def _decode_wav(audio_bytes):
+    try:
+        with wave.open(io.BytesIO(audio_bytes), 'rb') as wav:
+            rate, channels = wav.getframerate(), wav.getnchannels()
+            if wav.getsampwidth() != SAMPLE_WIDTH:
+                return None
+            frames = wav.readframes(wav.getnframes())
+    except wave.Error:
+        return None
+    if rate == TARGET_RATE and channels == 1:
+        return frames
+    samples = np.frombuffer(frames[:len(frames) - len(frames) % (SAMPLE_WIDTH * channels)],
+                            dtype='<i2').reshape(-1, channels)
+    mono = resample(samples.mean(axis=1), rate)
+    return np.clip(np.round(mono), -32768, 32767).astype('<i2').tobytes()
+
+
+def _decode_av(audio_bytes):
+    chunks = []
+    resampler = av.AudioResampler(format='s16', layout='mono', rate=TARGET_RATE)
+    with av.open(io.BytesIO(audio_bytes), mode='r') as container:
+        for frame in container.decode(audio=0):
+            for out in resampler.resample(frame):
+                chunks.append(out.to_ndarray().tobytes())
+    for out in resampler.resample(None):
+        chunks.append(out.to_ndarray().tobytes())
+    return b''.join(chunks)
+
+
+def _decode_ffmpeg(audio_bytes):
+    result = subprocess.run(
+        ['ffmpeg', '-loglevel', 'error', '-i', 'pipe:0',
+         '-f', 's16le', '-ar', str(TARGET_RATE), '-ac', '1', 'pipe:1'],
+        input=audio_bytes, capture_output=True, timeout=DECODE_TIMEOUT, check=True)
+    return result.stdout
+
+
+def decode_to_pcm(audio_bytes, mime_type=None):
+    fmt = sniff_format(audio_bytes, mime_type)
+    if fmt == 'pcm':
+        return audio_bytes
+    if fmt == 'wav':
+        pcm = _decode_wav(audio_bytes)
+        if pcm is not None:
+            return pcm
+    if av is not None:
+        return _decode_av(audio_bytes)
+    return _decode_ffmpeg(audio_bytes)
+
+
+class DecoderPool:
+    """Bounded set of long-lived decoder threads shared by all requests."""
+
+    def __init__(self, workers=DECODER_WORKERS, timeout=DECODE_TIMEOUT):
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers,
+                                            thread_name_prefix='audio-decoder')
+
+    def decode(self, audio_data):
+        try:
+            audio_bytes, mime_type = decode_base64(audio_data)
+            return self._executor.submit(decode_to_pcm, audio_bytes,
+                                         mime_type).result(self.timeout)
+        except Exception as e:
+            print(f"Audio conversion error: {e}")
+            return None
+
+
+def frame_rms(pcm):
+    samples = np.frombuffer(pcm[:len(pcm) - len(pcm) % 2], dtype='<i2').astype(np.float64)
+    if not len(samples):
+        return 0.0
+    return float(np.sqrt(np.mean(samples * samples)))
+
+
+def frame_levels(samples, frame):
+    """RMS of each whole frame of samples."""
+    count = len(samples) // frame
+    frames = samples[:count * frame].reshape(count, frame)
+    return np.sqrt(np.mean(frames * frames, axis=1))
+
+
+def preprocess_pcm(pcm, sample_rate=TARGET_RATE):
+    """Trim silence and normalize loudness of 16-bit mono PCM.
+
+    Returns (pcm, None), or (None, reason) for clips that should not reach
+    the recognizer: 'too_long' or 'silent'.
+    """
+    samples = np.frombuffer(pcm[:len(pcm) - len(pcm) % 2], dtype='<i2').astype(np.float32)
+    if len(samples) > MAX_AUDIO_SECONDS * sample_rate:
+        return None, 'too_long'
+    frame = sample_rate * VAD_FRAME_MS // 1000
+    levels = frame_levels(samples, frame)
+    if not len(levels) or levels.max() < VAD_MIN_RMS:
+        return None, 'silent'
+
+    # Speech is whatever rises well above the noise floor (the quietest 10% of
+    # frames); a clip with no quiet part at all is kept whole.
+    floor = np.percentile(levels, 10)
+    if floor * 3 >= levels.max() * 0.5:
+        voiced = np.arange(len(levels))
+    else:
+        voiced = np.flatnonzero(levels >= max(VAD_MIN_RMS, floor * 3))
+    padding = VAD_PADDING_MS // VAD_FRAME_MS
+    start = max(0, voiced[0] - padding) * frame
+    last = voiced[-1] + 1 + padding
+    end = len(samples) if last >= len(levels) else last * frame
+    samples = samples[start:end]
+
+    speech_rms = float(np.sqrt(np.mean(levels[voiced] ** 2)))
+    peak = float(np.abs(samples).max())
+    gain = min(TARGET_RMS / speech_rms, 32000.0 / peak, MAX_GAIN)
+    return np.clip(np.round(samples * gain), -32768, 32767).astype('<i2').tobytes(), None
+
+
+class EndpointDetector:
+    """Energy-based end-of-speech detection for streamed 16-bit mono PCM.
+
+    Speech starts after min_speech_ms of frames above threshold and ends after
+    hangover_ms of silence. Streams that never start speaking end after
+    leading_silence_ms, and every stream ends after max_ms.
+    """
+
+    def __init__(self, sample_rate=TARGET_RATE, frame_ms=30, threshold=500.0,
+                 min_speech_ms=90, hangover_ms=800, leading_silence_ms=5000, max_ms=15000):
+        self.frame_bytes = int(sample_rate * frame_ms / 1000) * SAMPLE_WIDTH
+        self.frame_ms = frame_ms
+        self.threshold = threshold
+        self.min_speech_ms = min_speech_ms
+        self.hangover_ms = hangover_ms
+        self.leading_silence_ms = leading_silence_ms
+        self.max_ms = max_ms
+
+        self.speech_started = False
+        self._buffer = b''
+        self._elapsed_ms = 0
+        self._voiced_ms = 0
+        self._silence_ms = 0
+
+    def accept(self, pcm):
+        """Feed audio; returns True once the utterance is over."""
+        self._buffer += pcm
+        while len(self._buffer) >= self.frame_bytes:
+            frame = self._buffer[:self.frame_bytes]
+            self._buffer = self._buffer[self.frame_bytes:]
+            self._elapsed_ms += self.frame_ms
+
+            if frame_rms(frame) >= self.threshold:
+                self._voiced_ms += self.frame_ms
+                self._silence_ms = 0
+                if self._voiced_ms >= self.min_speech_ms:
+                    self.speech_started = True
+            else:
+                self._silence_ms += self.frame_ms
+                if not self.speech_started:
+                    self._voiced_ms = 0
+
+            if self.speech_started and self._silence_ms >= self.hangover_ms:
+                return True
+            if not self.speech_started and self._elapsed_ms >= self.leading_silence_ms:
+                return True
+            if self._elapsed_ms >= self.max_ms:
+                return True
+        return False
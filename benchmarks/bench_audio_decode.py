@@ -0,0 +1,93 @@
+import io
+import os
+import sys
+import math
+import time
+import wave
+import base64
+import struct
+import argparse
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from common import summarize, report, time_calls
+
+import audio
+
+# Compares the old "write temp file, shell out to ffmpeg, read it back" path
+# with the in-process DecoderPool, for per-request latency and throughput.
+
+
+def make_wav(seconds=3.0, rate=48000):
+    frames = b''.join(
+        struct.pack('<h', int(8000 * math.sin(2 * math.pi * 440 * i / rate)))
+        for i in range(int(seconds * rate)))
+    buf = io.BytesIO()
+    with wave.open(buf, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(frames)
+    return buf.getvalue()
+
+
+def make_webm(wav_bytes):
+    result = subprocess.run(
+        ['ffmpeg', '-loglevel', 'error', '-f', 'wav', '-i', 'pipe:0',
+         '-c:a', 'libopus', '-f', 'webm', 'pipe:1'],
+        input=wav_bytes, capture_output=True, check=True)
+    return result.stdout
+
+
+def legacy_convert(audio_data, workdir):
+    # The pre-DecoderPool implementation, kept here only for comparison.
+    audio_bytes = base64.b64decode(audio_data)
+    tmp_input = os.path.join(workdir, "temp_input.webm")
+    tmp_output = os.path.join(workdir, "temp_output.wav")
+    with open(tmp_input, "wb") as f:
+        f.write(audio_bytes)
+    os.system(f"ffmpeg -loglevel quiet -i {tmp_input} -ar 16000 -ac 1 {tmp_output} -y")
+    with open(tmp_output, "rb") as f:
+        wav_data = f.read()
+    os.remove(tmp_input)
+    os.remove(tmp_output)
+    return wav_data
+
+
+def throughput(fn, requests, concurrency):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = list(pool.map(lambda _: time_calls(fn, 1)[0], range(requests)))
+    return summarize(samples, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=4)
+    args = parser.parse_args()
+
+    wav_bytes = make_wav()
+    inputs = {'wav-48k': wav_bytes}
+    try:
+        inputs['webm-opus'] = make_webm(wav_bytes)
+    except (OSError, subprocess.CalledProcessError):
+        print("ffmpeg not available; skipping the WebM input and the legacy path")
+
+    pool = audio.DecoderPool(workers=args.concurrency)
+    workdir = tempfile.mkdtemp()
+    for label, payload in inputs.items():
+        encoded = base64.b64encode(payload).decode()
+        report(f"pool/{label} latency", summarize(
+            time_calls(lambda: pool.decode(encoded), args.iterations)))
+        report(f"pool/{label} x{args.concurrency}",
+               throughput(lambda: pool.decode(encoded), args.iterations, args.concurrency))
+        if 'webm-opus' in inputs:
+            report(f"legacy/{label} latency", summarize(
+                time_calls(lambda: legacy_convert(encoded, workdir), args.iterations)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
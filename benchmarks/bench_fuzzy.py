@@ -0,0 +1,63 @@
+import time
+import random
+import string
+import argparse
+
+from common import summarize, report, time_calls
+
+from fuzzy import FuzzyIndex
+
+# Fuzzy product lookup latency on a large synthetic catalog, for single
+# queries and for batches like the ones parse_command sends.
+
+
+def misspell(rng, name):
+    chars = list(name)
+    i = rng.randrange(len(chars))
+    op = rng.choice(('drop', 'swap', 'replace'))
+    if op == 'drop' and len(chars) > 3:
+        del chars[i]
+    elif op == 'swap' and i + 1 < len(chars):
+        chars[i], chars[i + 1] = chars[i + 1], chars[i]
+    else:
+        chars[i] = rng.choice(string.ascii_lowercase)
+    return ''.join(chars)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--products', type=int, default=50000)
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--batch', type=int, default=6)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    words = [''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 9)))
+             for _ in range(5000)]
+    names = set()
+    while len(names) < args.products:
+        names.add(' '.join(rng.sample(words, rng.randint(1, 3))))
+    names = sorted(names)
+
+    start = time.perf_counter()
+    index = FuzzyIndex(names)
+    print(f"built index over {len(names)} products, {len(index.gram_ids)} grams "
+          f"in {(time.perf_counter() - start) * 1000:.0f}ms")
+
+    targets = [rng.choice(names) for _ in range(args.iterations)]
+    queries = [misspell(rng, name) for name in targets]
+    hits = sum(name in dict(index.match(q, 5)) for q, name in zip(queries[:500], targets[:500]))
+    print(f"misspelled name in top 5: {hits / min(500, len(queries)):.1%}")
+
+    it = iter(queries)
+    report('single query (top 5)', summarize(time_calls(lambda: index.match(next(it)),
+                                                        args.iterations)))
+    batches = [queries[i:i + args.batch] for i in range(0, len(queries), args.batch)]
+    it = iter(batches)
+    samples = time_calls(lambda: index.match_many(next(it)), len(batches))
+    stats = summarize([sample / args.batch for sample in samples])
+    report(f"batched query, per query (batch {args.batch})", stats)
+
+
+if __name__ == '__main__':
+    main()
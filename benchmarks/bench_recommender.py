@@ -0,0 +1,99 @@
+import random
+import argparse
+from datetime import datetime
+
+from common import summarize, report, time_calls
+
+from recommender import CoOccurrence
+
+# Compares the old generate_suggestions (random samples over whole categories,
+# seasonal items, the last history entries and sales, deduplicated with set())
+# with co-occurrence lookups, on a synthetic catalog and synthetic users.
+
+
+def make_data(rng, categories, per_category, users, list_size):
+    products = {f"category-{c}": [f"product-{c}-{i}" for i in range(per_category)]
+                for c in range(categories)}
+    names = [name for items in products.values() for name in items]
+    data = {
+        'products': products,
+        'substitutes': {names[i]: rng.sample(names, 3) for i in range(0, len(names), 50)},
+        'seasonal_items': {season: rng.sample(names, 8)
+                           for season in ('winter', 'spring', 'summer', 'fall')},
+        'sales': {'current': [{'item': name, 'discount': '10%'} for name in rng.sample(names, 20)]},
+        'users': {},
+    }
+    for u in range(users):
+        basket = rng.sample(names, list_size)
+        data['users'][f"user-{u}"] = {
+            'shopping_list': [{'name': name, 'category': name.rsplit('-', 1)[0].replace('product', 'category')}
+                              for name in basket],
+            'history': [{'name': name} for name in basket],
+        }
+    return data, names
+
+
+def legacy_generate_suggestions(data, item_name, user_id):
+    user = data['users'][user_id]
+    suggestions = []
+    for product, substitutes in data['substitutes'].items():
+        if product in item_name:
+            suggestions.extend(substitutes)
+    user_categories = {item['category'] for item in user['shopping_list']}
+    for category in user_categories:
+        if category in data['products']:
+            category_items = [item['name'] if isinstance(item, dict) else item
+                              for item in data['products'][category]]
+            suggestions.extend(random.sample(category_items, min(2, len(category_items))))
+    month = datetime.now().month
+    season = ('winter' if month in [12, 1, 2] else 'spring' if month in [3, 4, 5]
+              else 'summer' if month in [6, 7, 8] else 'fall')
+    suggestions.extend(data['seasonal_items'][season])
+    history = user['history'][-5:]
+    if len(history) >= 5:
+        suggestions.extend(item['name'] for item in history)
+    for sale in data.get('sales', {}).get('current', []):
+        suggestions.append(sale['item'] + " (on sale!)")
+    suggestions = list(set(suggestions))
+    if item_name in suggestions:
+        suggestions.remove(item_name)
+    return suggestions[:5]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--per-category', type=int, default=200)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--list-size', type=int, default=25)
+    parser.add_argument('--iterations', type=int, default=5000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    data, names = make_data(rng, args.categories, args.per_category, args.users, args.list_size)
+    user_ids = list(data['users'])
+
+    recommender = CoOccurrence()
+    samples = time_calls(lambda: recommender.rebuild(
+        [[item['name'] for item in user['shopping_list']] for user in data['users'].values()]), 1)
+    print(f"offline rebuild over {len(user_ids)} baskets: {samples[0] * 1000:.1f}ms, "
+          f"{sum(len(row) for row in recommender.counts.values())} non-zero cells")
+
+    def legacy():
+        user_id = rng.choice(user_ids)
+        legacy_generate_suggestions(data, rng.choice(names), user_id)
+
+    def observe():
+        user = data['users'][rng.choice(user_ids)]
+        recommender.observe(rng.choice(names), [item['name'] for item in user['shopping_list']])
+
+    def related():
+        recommender.related(rng.choice(names), 5)
+
+    report('legacy generate_suggestions', summarize(time_calls(legacy, args.iterations)))
+    report('co-occurrence observe (incremental)', summarize(time_calls(observe, args.iterations)))
+    report('co-occurrence related (top-5)', summarize(time_calls(related, args.iterations)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import random
+import argparse
+
+from common import summarize, report, time_calls
+
+from catalog import CatalogIndex
+from search import CatalogSearch
+
+# Compares the old search_items filtering (a per-product check of brand, type,
+# organic and price over every substring match) with the bitset/sorted-price
+# CatalogSearch, for filtered queries on a large synthetic catalog.
+
+BRANDS = [f"brand{i}" for i in range(200)]
+
+
+def make_catalog(rng, categories, per_category):
+    products = {}
+    for c in range(categories):
+        items = []
+        for i in range(per_category):
+            product = {'name': f"{rng.choice(['organic ', ''])}item {c} {i}",
+                       'price': round(rng.uniform(0.5, 50), 2)}
+            if rng.random() < 0.8:
+                product['brands'] = rng.sample(BRANDS, 3)
+            items.append(product)
+        products[f"category{c}"] = items
+    return products
+
+
+def legacy_search(catalog, item_name, price_filter=None, brand=None, organic=False):
+    results = []
+    for product_name in catalog.search(item_name):
+        category, product = catalog.lookup(product_name)
+        matches = True
+        if brand and 'brands' in product:
+            matches = matches and brand in product['brands']
+        if organic:
+            matches = matches and "organic" in product_name.lower()
+        if matches and price_filter and 'price' in product:
+            price = product['price']
+            if 'max' in price_filter and price > price_filter['max']:
+                matches = False
+            if 'min' in price_filter and price < price_filter['min']:
+                matches = False
+        if matches:
+            results.append(product_name)
+    return results[:5], len(results)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--categories', type=int, default=50)
+    parser.add_argument('--per-category', type=int, default=1000)
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    catalog = CatalogIndex(make_catalog(rng, args.categories, args.per_category))
+    engine = CatalogSearch(catalog)
+
+    def query():
+        low = rng.uniform(0, 40)
+        return {'price_filter': {'min': low, 'max': low + 5}, 'brand': rng.choice(BRANDS),
+                'organic': rng.random() < 0.5}
+
+    queries = [query() for _ in range(args.iterations)]
+    for q in queries[:20]:
+        legacy_total = legacy_search(catalog, 'item', **q)[1]
+        total = engine.search('item', brands=[q['brand']], organic=q['organic'],
+                              min_price=q['price_filter']['min'],
+                              max_price=q['price_filter']['max'])['total']
+        assert legacy_total == total, (q, legacy_total, total)
+
+    it = iter(queries)
+    report('legacy scan (text + filters)', summarize(time_calls(
+        lambda: legacy_search(catalog, 'item', **next(it)), len(queries))))
+
+    it = iter(queries)
+
+    def faceted():
+        q = next(it)
+        engine.search('item', brands=[q['brand']], organic=q['organic'],
+                      min_price=q['price_filter']['min'], max_price=q['price_filter']['max'],
+                      per_page=5)
+    report('CatalogSearch (text + filters)', summarize(time_calls(faceted, len(queries))))
+
+    it = iter(queries)
+
+    def browse():
+        q = next(it)
+        engine.search(categories=['category1', 'category2'], brands=[q['brand']],
+                      min_price=q['price_filter']['min'], max_price=q['price_filter']['max'],
+                      sort='price', per_page=20)
+    report('CatalogSearch (facets only, by price)', summarize(time_calls(browse, len(queries))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import json
+import random
+import argparse
+
+from common import summarize, report, time_calls
+
+from persistence import ShoppingList, item_key
+
+# Compares the old list-of-lines shopping list (linear scan to merge, scan and
+# pop to remove) with the variant-keyed ShoppingList on long lists, and the
+# full /shopping-list payload with a delta after a single change.
+
+BRANDS = [None, 'Acme', 'Farmhouse', 'Store Brand']
+TYPES = [None, 'whole', 'skim', 'large']
+
+
+def make_line(i, rng):
+    return {'name': f"product-{i // 4}", 'quantity': 1, 'category': 'other',
+            'added_on': '2024-01-01', 'brand': rng.choice(BRANDS),
+            'type': rng.choice(TYPES), 'organic': rng.random() < 0.2}
+
+
+def legacy_add(shopping_list, item):
+    for existing in shopping_list:
+        if item_key(existing) == item_key(item):
+            existing['quantity'] += item['quantity']
+            return existing
+    shopping_list.append(item)
+    return item
+
+
+def legacy_remove(shopping_list, name):
+    for i, existing in enumerate(shopping_list):
+        if existing['name'] == name:
+            return shopping_list.pop(i)
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', type=int, default=10000)
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    lines = [make_line(i, rng) for i in range(args.lines)]
+    names = [line['name'] for line in lines]
+
+    legacy = []
+    for line in lines:
+        legacy_add(legacy, dict(line))
+    indexed = ShoppingList(dict(line) for line in lines)
+    print(f"{len(indexed)} distinct lines")
+
+    # Merging into lines near the end of the list is the legacy worst case.
+    tail = lines[-args.lines // 10:]
+    report('legacy add (merge)', summarize(time_calls(
+        lambda: legacy_add(legacy, dict(rng.choice(tail))), args.iterations)))
+    report('indexed add (merge)', summarize(time_calls(
+        lambda: indexed.add(dict(rng.choice(tail))), args.iterations)))
+
+    counter = iter(range(args.lines, args.lines * 10))
+    report('legacy add (new line)', summarize(time_calls(
+        lambda: legacy_add(legacy, make_line(next(counter) * 4, rng)), args.iterations)))
+    counter = iter(range(args.lines, args.lines * 10))
+    report('indexed add (new line)', summarize(time_calls(
+        lambda: indexed.add(make_line(next(counter) * 4, rng)), args.iterations)))
+
+    removals = rng.sample(sorted(set(names)), min(args.iterations, len(set(names))))
+    it = iter(removals)
+    report('legacy remove', summarize(time_calls(
+        lambda: legacy_remove(legacy, next(it)), len(removals))))
+    it = iter(removals)
+    report('indexed remove (all variants)', summarize(time_calls(
+        lambda: indexed.remove_name(next(it)), len(removals))))
+
+    report('legacy list copy', summarize(time_calls(lambda: list(legacy), 200)))
+    report('indexed list copy', summarize(time_calls(lambda: list(indexed), 200)))
+
+    since = indexed.version
+    indexed.add(dict(rng.choice(tail)))
+    full = json.dumps({'version': indexed.version, 'shopping_list': indexed.to_list()})
+    delta = json.dumps(indexed.changes_since(since))
+    print(f"payload after one change: full {len(full)} bytes, delta {len(delta)} bytes")
+    report('full list payload', summarize(time_calls(
+        lambda: json.dumps({'version': indexed.version, 'shopping_list': indexed.to_list()}), 200)))
+    report('delta payload (1 change)', summarize(time_calls(
+        lambda: json.dumps(indexed.changes_since(since)), 200)))
+
+
+if __name__ == '__main__':
+    main()
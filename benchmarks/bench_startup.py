@@ -0,0 +1,61 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+from common import ROOT, percentile
+
+# Measures cold start in fresh interpreters: `import app`, then create_app(),
+# with outbound connections made to fail so any network use at startup shows
+# up as an error. Also lists which heavy modules were loaded. Point --root at
+# another checkout (e.g. a `git worktree` of an older commit) to compare.
+
+HEAVY_MODULES = ['nltk', 'speech_recognition', 'gtts', 'av', 'vosk', 'audio', 'speech']
+
+PROBE = r'''
+import json, socket, sys, time
+
+def refuse(*args, **kwargs):
+    raise OSError("network access during startup")
+socket.socket.connect = refuse
+socket.create_connection = refuse
+
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+if hasattr(app, 'create_app'):
+    app.create_app()
+ready = time.perf_counter()
+print(json.dumps({'import': imported - start, 'ready': ready - start,
+                  'modules': [m for m in HEAVY if m in sys.modules]}))
+'''
+
+
+def probe(root, env):
+    code = f"HEAVY = {HEAVY_MODULES!r}\n" + PROBE
+    result = subprocess.run([sys.executable, '-c', code], cwd=root, env=env,
+                            capture_output=True, text=True, timeout=300)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr else 'failed')
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--root', default=ROOT)
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    env = dict(os.environ, TTS_PREWARM='1', PYTHONDONTWRITEBYTECODE='1')
+    runs = [probe(args.root, env) for _ in range(args.runs)]
+
+    for key in ('import', 'ready'):
+        samples = [run[key] for run in runs]
+        print(f"{key:<8} p50={percentile(samples, 50) * 1000:8.1f}ms "
+              f"p95={percentile(samples, 95) * 1000:8.1f}ms")
+    print(f"heavy modules loaded at startup: {', '.join(runs[-1]['modules']) or 'none'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+import os
+import sys
+import json
+import random
+import argparse
+import tempfile
+import subprocess
+
+from common import (ROOT, summarize, report, time_calls, make_catalog, make_users, make_commands,
+                    catalog_names, stub_environment, write_data, load_app, save_baseline,
+                    compare_baseline)
+
+# End-to-end microbenchmarks of the command pipeline at several catalog and
+# user-base sizes. Each scale runs in its own process against a generated
+# data directory, with the offline STT/TTS engines, so results do not depend
+# on the network or on what earlier scales left in memory.
+#
+#   python benchmarks/bench_suite.py --scales small,medium --save-baseline
+#   python benchmarks/bench_suite.py --scales small,medium --compare
+#
+# --compare exits non-zero when any p50/p95 is more than --tolerance slower
+# than the saved baseline.
+
+SCALES = {
+    'small': {'products': 100, 'users': 10},
+    'medium': {'products': 5000, 'users': 1000},
+    'large': {'products': 50000, 'users': 100000},
+}
+# The phrases users repeat all day; parse_command answers these from its cache.
+REPEATED = ["what's on my list", "clear my list", "suggest something", "add milk",
+            "add two eggs", "remove bread"]
+BASELINE_FILE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+
+
+def run_scale(scale, iterations, out):
+    config = SCALES[scale]
+    workdir = tempfile.mkdtemp(prefix=f"bench-{scale}-")
+    catalog = make_catalog(config['products'])
+    write_data(workdir, catalog, make_users(config['users'], catalog))
+    app = load_app(workdir, stub_environment(workdir))
+
+    rng = random.Random(1)
+    names = catalog_names(catalog)
+    commands = make_commands(catalog, iterations, seed=1)
+    user_ids = [f"user-{rng.randrange(config['users'])}" for _ in range(iterations)]
+    results = {}
+
+    def bench(name, fn):
+        for i in range(min(20, iterations)):
+            fn(i)
+        it = iter(range(iterations))
+        stats = summarize(time_calls(lambda: fn(next(it)), iterations))
+        results[f"{scale}/{name}"] = stats
+        report(f"{scale}/{name}", stats)
+
+    with app.app.test_request_context():
+        bench('parse_command', lambda i: app.parse_command(commands[i]))
+        bench('parse_command_repeated', lambda i: app.parse_command(REPEATED[i % len(REPEATED)]))
+        bench('parse_quantity', lambda i: app.parse_quantity(commands[i]))
+        bench('add_item', lambda i: app.add_item(names[i % len(names)], 2, user_id=user_ids[i]))
+        bench('search_items', lambda i: app.search_items(names[i % len(names)][:4],
+                                                         price_filter={'max': 20}))
+        bench('generate_suggestions', lambda i: app.generate_suggestions(
+            names[i % len(names)], user_id=user_ids[i]))
+        bench('process_command', lambda i: app.process_command(commands[i], user_id=user_ids[i]))
+    # Saving is a WAL compaction: a full snapshot of every user.
+    saves = max(1, iterations // 100)
+    results[f"{scale}/save"] = summarize(time_calls(app.wal.compact, saves))
+    report(f"{scale}/save", results[f"{scale}/save"])
+
+    with open(out, 'w') as f:
+        json.dump(results, f)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scales', default='small,medium')
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--compare', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed slowdown before --compare fails (0.25 = 25%%)')
+    parser.add_argument('--min-ms', type=float, default=0.05,
+                        help='ignore slowdowns smaller than this many milliseconds')
+    parser.add_argument('--run-scale', help=argparse.SUPPRESS)
+    parser.add_argument('--out', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_scale:
+        run_scale(args.run_scale, args.iterations, args.out)
+        return
+
+    results = {}
+    for scale in args.scales.split(','):
+        if scale not in SCALES:
+            parser.error(f"unknown scale {scale}; choose from {', '.join(SCALES)}")
+        fd, out = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--run-scale', scale,
+                        '--iterations', str(args.iterations), '--out', out], check=True)
+        with open(out, 'r') as f:
+            results.update(json.load(f))
+        os.remove(out)
+
+    if args.save_baseline:
+        save_baseline(args.baseline, results)
+    if args.compare and compare_baseline(args.baseline, results, args.tolerance,
+                                         args.min_ms):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
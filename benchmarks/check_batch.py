@@ -0,0 +1,58 @@
+import os
+import sys
+import shutil
+import tempfile
+
+from common import ROOT, stub_environment, load_app
+
+# Sends malformed /batch-command payloads and checks that each is answered
+# with a 400 or a per-item "Invalid ..." result instead of a server error,
+# and that nothing invalid reaches the list. Exits non-zero on any mismatch.
+
+INVALID_ENTRIES = [
+    1, None, True, [], ['add milk'],
+    {'action': 'add'},
+    {'action': 'add', 'name': 5},
+    {'action': 'add', 'name': ['milk']},
+    {'action': 'add', 'name': {'n': 'milk'}},
+    {'action': 7, 'name': 'milk'},
+    {'action': 'add', 'name': 'milk', 'brand': 3},
+    {'action': 'add', 'name': 'milk', 'quantity': 0},
+    {'action': 'add', 'name': 'milk', 'quantity': -2},
+    {'action': 'add', 'name': 'milk', 'quantity': 'lots'},
+]
+BAD_REQUESTS = [[], 'add milk', {'command': 5}, {'commands': 'add milk'}, {'commands': []}]
+
+
+def main():
+    workdir = tempfile.mkdtemp(prefix='batch-')
+    os.makedirs(os.path.join(workdir, 'data'))
+    shutil.copy(os.path.join(ROOT, 'data', 'shopping_data.json'),
+                os.path.join(workdir, 'data', 'shopping_data.json'))
+    app = load_app(workdir, stub_environment(workdir))
+    client = app.app.test_client()
+
+    failures = 0
+    for entry in INVALID_ENTRIES:
+        response = client.post('/batch-command', json={'commands': [entry, 'add eggs']})
+        results = response.get_json()['results'] if response.status_code == 200 else None
+        ok = (results is not None and results[0]['response'].startswith('Invalid') and
+              not results[1]['response'].startswith('Invalid'))
+        failures += not ok
+        print(f"{'ok' if ok else 'FAIL':4}  {entry!r:50} -> {response.status_code} "
+              f"{results[0]['response'] if results else ''}")
+    for payload in BAD_REQUESTS:
+        response = client.post('/batch-command', json=payload)
+        ok = response.status_code == 400
+        failures += not ok
+        print(f"{'ok' if ok else 'FAIL':4}  {payload!r:50} -> {response.status_code}")
+
+    names = [item['name'] for item in client.get('/shopping-list').get_json()['shopping_list']]
+    ok = names == ['eggs']
+    failures += not ok
+    print(f"{'ok' if ok else 'FAIL':4}  list afterwards: {names}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,46 @@
+import os
+import sys
+import shutil
+import tempfile
+
+from common import ROOT, stub_environment, load_app
+
+# Checks what "add <word>" puts on the list with the default catalog:
+# misspelled products must still be found, and ordinary groceries that are
+# not in the catalog must be added as they are, not swapped for a product
+# with a similar spelling. Exits non-zero on any mismatch.
+
+CASES = {
+    'bred': 'bread',
+    'brad': 'bread',
+    'chese': 'cheese',
+    'yoghurt': 'yogurt',
+    'letuce': 'lettuce',
+    'tomatos': 'tomatoes',
+    'chiken': 'chicken',
+    'rice': 'rice',
+    'beer': 'beer',
+    'potatoes': 'potatoes',
+    'corn': 'corn',
+    'cream': 'cream',
+}
+
+
+def main():
+    workdir = tempfile.mkdtemp(prefix='fuzzy-')
+    os.makedirs(os.path.join(workdir, 'data'))
+    shutil.copy(os.path.join(ROOT, 'data', 'shopping_data.json'),
+                os.path.join(workdir, 'data', 'shopping_data.json'))
+    app = load_app(workdir, stub_environment(workdir))
+
+    failures = 0
+    for word, expected in CASES.items():
+        item = app.parse_command(f"add {word}")[1]
+        status = 'ok' if item == expected else 'FAIL'
+        failures += item != expected
+        print(f"{status:4}  add {word:10} -> {item} (expected {expected})")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
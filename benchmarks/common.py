@@ -0,0 +1,228 @@
+import io
+import os
+import sys
+import json
+import math
+import time
+import wave
+import base64
+import random
+import struct
+import hashlib
+
+# Shared helpers for the scripts in this directory. Run them from the repo
+# root, e.g. `python benchmarks/bench_audio_decode.py`.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def time_calls(fn, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def summarize(samples, wall=None):
+    wall = wall if wall is not None else sum(samples)
+    return {
+        'count': len(samples),
+        'p50_ms': percentile(samples, 50) * 1000,
+        'p95_ms': percentile(samples, 95) * 1000,
+        'p99_ms': percentile(samples, 99) * 1000,
+        'throughput': len(samples) / wall if wall else 0.0,
+    }
+
+
+def report(name, stats):
+    print(f"{name:<40} n={stats['count']:<6} p50={stats['p50_ms']:9.3f}ms "
+          f"p95={stats['p95_ms']:9.3f}ms p99={stats['p99_ms']:9.3f}ms "
+          f"{stats['throughput']:10.1f}/s")
+
+
+# Synthetic data shared by the suite and the load test. Everything is seeded,
+# so two runs at the same scale see the same catalog, users and commands.
+
+CATEGORY_COUNT = 20
+BRANDS = [f"brand {i}" for i in range(100)]
+TYPES = ['small', 'large', 'family size', 'low fat', 'whole', 'sliced']
+
+
+def make_catalog(products, seed=0):
+    rng = random.Random(seed)
+    syllables = ['ba', 'co', 'di', 'fe', 'gu', 'ha', 'ki', 'lo', 'mu', 'ne', 'pa', 'ro',
+                 'si', 'tu', 'va', 'xe', 'yo', 'za']
+    catalog = {f"category {c}": [] for c in range(min(CATEGORY_COUNT, products))}
+    categories = list(catalog)
+    names = set()
+    while len(names) < products:
+        word = ''.join(rng.choice(syllables) for _ in range(rng.randint(2, 4)))
+        name = word if rng.random() < 0.6 else f"{rng.choice(['organic ', 'fresh ', ''])}{word}"
+        if name in names:
+            continue
+        names.add(name)
+        product = {'name': name, 'price': round(rng.uniform(0.5, 40), 2)}
+        if rng.random() < 0.7:
+            product['brands'] = rng.sample(BRANDS, 3)
+        if rng.random() < 0.3:
+            product['types'] = rng.sample(TYPES, 2)
+        catalog[categories[len(names) % len(categories)]].append(product)
+    return catalog
+
+
+def catalog_names(catalog):
+    return [product['name'] for items in catalog.values() for product in items]
+
+
+def make_users(count, catalog, list_size=10, history_size=20, seed=0):
+    rng = random.Random(seed)
+    names = catalog_names(catalog)
+    category_of = {product['name']: category
+                   for category, items in catalog.items() for product in items}
+
+    def line(name):
+        return {'name': name, 'quantity': rng.randint(1, 3), 'category': category_of[name],
+                'added_on': f"2024-0{rng.randint(1, 9)}-1{rng.randint(0, 9)}T10:00:00",
+                'brand': None, 'type': None, 'organic': False}
+
+    return {f"user-{u}": {'shopping_list': [line(n) for n in rng.sample(names, min(list_size, len(names)))],
+                          'history': [line(n) for n in rng.choices(names, k=history_size)],
+                          'preferences': {}}
+            for u in range(count)}
+
+
+def make_commands(catalog, count, seed=0):
+    rng = random.Random(seed)
+    names = catalog_names(catalog)
+    templates = ["add {n} {name}", "add {name}", "remove {name}", "find {name} under ${p}",
+                 "what's on my list", "suggest something", "i need {n} {name} and {name2}",
+                 "add {typo}"]
+    commands = []
+    for _ in range(count):
+        name, name2 = rng.choice(names), rng.choice(names)
+        typo = name[:-1] if len(name) > 4 else name
+        commands.append(rng.choice(templates).format(
+            n=rng.choice(['two', 'three', '2', '5']), name=name, name2=name2,
+            p=rng.randint(2, 20), typo=typo))
+    return commands
+
+
+def make_wav(seconds=1.0, frequency=440.0, rate=16000):
+    """16 kHz mono s16 WAV, the format uploads are decoded to, so no ffmpeg is needed."""
+    frames = b''.join(
+        struct.pack('<h', int(6000 * math.sin(2 * math.pi * frequency * i / rate)))
+        for i in range(int(seconds * rate)))
+    buf = io.BytesIO()
+    with wave.open(buf, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(frames)
+    return buf.getvalue(), frames
+
+
+def make_audio_fixtures(commands, directory):
+    """Write one clip per command plus the transcripts file for the stub STT engine.
+
+    Returns [(base64 clip, transcript)]. The stub engine looks transcripts up by
+    the SHA-1 of the PCM it is given, i.e. after preprocess_pcm (see
+    speech.StubEngine).
+    """
+    from audio import preprocess_pcm
+
+    os.makedirs(directory, exist_ok=True)
+    transcripts, fixtures = {}, []
+    for i, command in enumerate(commands):
+        wav_bytes, pcm = make_wav(seconds=0.5, frequency=200.0 + 7 * i)
+        with open(os.path.join(directory, f"clip-{i}.wav"), 'wb') as f:
+            f.write(wav_bytes)
+        # The recognizer sees the clip after preprocessing (AUDIO_PREPROCESS).
+        transcripts[hashlib.sha1(preprocess_pcm(pcm)[0]).hexdigest()] = command
+        fixtures.append((base64.b64encode(wav_bytes).decode(), command))
+    path = os.path.join(directory, 'transcripts.json')
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(transcripts, f)
+    return fixtures, path
+
+
+def stub_environment(workdir, transcripts_path=None):
+    """Environment for running the app offline against workdir."""
+    env = {
+        'STT_ENGINE': 'stub',
+        'STT_STUB_TEXT': "what's on my list",
+        'TTS_ENGINE': 'stub',
+        'TTS_PREWARM': '0',
+        'TTS_CACHE_DIR': os.path.join(workdir, 'tts-cache'),
+        'RECOMMENDATIONS_FILE': os.path.join(workdir, 'data', 'recommendations.json'),
+        'SQLITE_PATH': os.path.join(workdir, 'data', 'shopping.db'),
+    }
+    if transcripts_path:
+        env['STT_STUB_TRANSCRIPTS'] = transcripts_path
+    return env
+
+
+def write_data(workdir, catalog, users):
+    data_dir = os.path.join(workdir, 'data')
+    os.makedirs(data_dir, exist_ok=True)
+    with open(os.path.join(ROOT, 'data', 'shopping_data.json'), 'r') as f:
+        base = json.load(f)
+    base['products'] = catalog
+    base['users'] = users
+    with open(os.path.join(data_dir, 'shopping_data.json'), 'w') as f:
+        json.dump(base, f)
+
+
+def load_app(workdir, env):
+    """Import the app against the data in workdir with the given environment."""
+    os.environ.update(env)
+    os.chdir(workdir)
+    import app
+    app.create_app()
+    return app
+
+
+# Baselines: a JSON object of benchmark name -> summarize() stats.
+
+def save_baseline(path, results):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print(f"Saved baseline to {path}")
+
+
+def compare_baseline(path, results, tolerance, min_ms=0.05):
+    """Print p50/p95 changes against the baseline; returns the names that regressed.
+
+    A change counts as a regression when it is over tolerance (a fraction) and
+    over min_ms, so timer noise on microsecond calls does not fail a run.
+    """
+    if not os.path.exists(path):
+        print(f"No baseline at {path}; run with --save-baseline first")
+        return []
+    with open(path, 'r') as f:
+        baseline = json.load(f)
+    regressions = []
+    for name, stats in sorted(results.items()):
+        base = baseline.get(name)
+        if not base:
+            continue
+        changes = {key: (stats[key] - base[key]) / base[key] if base[key] else 0.0
+                   for key in ('p50_ms', 'p95_ms')}
+        regressed = any(change > tolerance and stats[key] - base[key] > min_ms
+                        for key, change in changes.items())
+        if regressed:
+            regressions.append(name)
+        print(f"{name:<40} p50 {changes['p50_ms']:+7.1%}  p95 {changes['p95_ms']:+7.1%}"
+              f"{'  REGRESSION' if regressed else ''}")
+    return regressions
@@ -0,0 +1,158 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import http.cookiejar
+import urllib.request
+
+from common import (ROOT, summarize, report, make_catalog, make_users, make_commands,
+                    make_audio_fixtures, stub_environment, write_data, load_app, save_baseline,
+                    compare_baseline)
+
+# Load test: concurrent clients sending a mix of /text-command, /voice-command
+# and /shopping-list requests, each client keeping its own session.
+#
+# By default the app runs in-process on a generated catalog with the offline
+# STT/TTS engines and Flask test clients. With --url the same traffic goes to
+# a running server instead; start it with the stub engines so it can
+# transcribe the audio fixtures, e.g.
+#
+#   python benchmarks/load_test.py --fixtures /tmp/load   # writes the fixtures
+#   STT_ENGINE=stub STT_STUB_TRANSCRIPTS=/tmp/load/transcripts.json TTS_ENGINE=stub \
+#       gunicorn --config gunicorn.conf.py
+#   python benchmarks/load_test.py --fixtures /tmp/load --url http://127.0.0.1:5000
+
+BASELINE_FILE = os.path.join(ROOT, 'benchmarks', 'load_baseline.json')
+MIX = {'text': 0.6, 'voice': 0.2, 'list': 0.2}
+
+
+class TestClient:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def post(self, path, payload):
+        response = self.client.post(path, json=payload)
+        return response.status_code
+
+    def get(self, path):
+        return self.client.get(path).status_code
+
+
+class HTTPClient:
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def _send(self, request):
+        try:
+            with self.opener.open(request, timeout=30) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    def post(self, path, payload):
+        return self._send(urllib.request.Request(
+            self.url + path, data=json.dumps(payload).encode(),
+            headers={'Content-Type': 'application/json'}))
+
+    def get(self, path):
+        return self._send(urllib.request.Request(self.url + path))
+
+
+def run_load(make_client, commands, clips, clients, duration, seed=0):
+    samples = {endpoint: [] for endpoint in MIX}
+    errors = {endpoint: 0 for endpoint in MIX}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(n):
+        rng = random.Random(seed + n)
+        client = make_client()
+        local = {endpoint: [] for endpoint in MIX}
+        failed = {endpoint: 0 for endpoint in MIX}
+        while time.perf_counter() < deadline:
+            endpoint = rng.choices(list(MIX), weights=list(MIX.values()))[0]
+            start = time.perf_counter()
+            if endpoint == 'text':
+                status = client.post('/text-command', {'command': rng.choice(commands)})
+            elif endpoint == 'voice':
+                status = client.post('/voice-command', {'audio': rng.choice(clips)[0]})
+            else:
+                status = client.get('/shopping-list')
+            local[endpoint].append(time.perf_counter() - start)
+            if status != 200:
+                failed[endpoint] += 1
+        with lock:
+            for endpoint in MIX:
+                samples[endpoint].extend(local[endpoint])
+                errors[endpoint] += failed[endpoint]
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    results = {}
+    for endpoint in MIX:
+        stats = results[endpoint] = summarize(samples[endpoint], wall)
+        stats['errors'] = errors[endpoint]
+        report(f"{endpoint} ({errors[endpoint]} errors)", stats)
+    total = [sample for endpoint in MIX for sample in samples[endpoint]]
+    results['all'] = summarize(total, wall)
+    results['all']['errors'] = sum(errors.values())
+    report('all', results['all'])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', help='load a running server instead of the in-process app')
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--fixtures', help='directory for the audio fixtures (default: temporary)')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--compare', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--min-ms', type=float, default=0.5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='load-')
+    catalog = make_catalog(args.products)
+    commands = make_commands(catalog, 500, seed=2)
+    clips, transcripts = make_audio_fixtures(commands[:50], args.fixtures or
+                                             os.path.join(workdir, 'audio'))
+
+    if args.url:
+        def make_client():
+            return HTTPClient(args.url)
+    else:
+        write_data(workdir, catalog, make_users(args.users, catalog))
+        app = load_app(workdir, stub_environment(workdir, transcripts)).app
+
+        def make_client():
+            return TestClient(app)
+
+    results = run_load(make_client, commands, clips, args.clients, args.duration)
+    if results['all']['errors']:
+        print(f"{results['all']['errors']} requests failed")
+
+    if args.save_baseline:
+        save_baseline(args.baseline, results)
+    if args.compare and compare_baseline(args.baseline, results, args.tolerance, args.min_ms):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+import os
+import sys
+import json
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+
+from common import ROOT  # noqa: F401  (puts the repo root on sys.path)
+
+from persistence import WriteAheadLog
+from storage import MemoryStorage, SQLiteStorage
+
+# Hammers every storage backend with concurrent adds, removes and batches on a
+# handful of shared users (plus, for the journaled backend, compactions while
+# writes are in flight) and checks that no update was lost: final quantities
+# must equal what the threads added, and replaying the WAL must reproduce the
+# in-memory state. Exits non-zero on any mismatch.
+
+PRODUCTS = ['milk', 'bread', 'eggs', 'apples', 'cheese', 'rice']
+
+
+def item(name, quantity=1):
+    return {'name': name, 'quantity': quantity, 'category': 'other',
+            'added_on': '2024-01-01', 'brand': None, 'type': None, 'organic': False}
+
+
+def worker(storage, users, ops, seed, totals, totals_lock):
+    rng = random.Random(seed)
+    local = {}
+    for _ in range(ops):
+        user_id = rng.choice(users)
+        name = rng.choice(PRODUCTS)
+        roll = rng.random()
+        if roll < 0.1:
+            # A marker product only this thread touches, removed again, so
+            # removals race with everything else without breaking the totals.
+            marker = f"marker-{seed}"
+            storage.add_item(user_id, item(marker))
+            storage.remove_item(user_id, marker)
+        elif roll < 0.3:
+            with storage.batch(user_id):
+                storage.add_item(user_id, item(name, 2))
+                storage.add_history(user_id, item(name, 2))
+            local[(user_id, name)] = local.get((user_id, name), 0) + 2
+        else:
+            storage.ensure_user(user_id)
+            storage.add_item(user_id, item(name))
+            local[(user_id, name)] = local.get((user_id, name), 0) + 1
+    with totals_lock:
+        for key, quantity in local.items():
+            totals[key] = totals.get(key, 0) + quantity
+
+
+def quantities(storage, users):
+    found = {}
+    for user_id in users:
+        for line in storage.get_shopping_list(user_id):
+            found[(user_id, line['name'])] = found.get((user_id, line['name']), 0) + line['quantity']
+    return found
+
+
+def run(name, storage, args, during=None):
+    users = [f"user-{i}" for i in range(args.users)]
+    for user_id in users:
+        storage.ensure_user(user_id)
+
+    totals, totals_lock = {}, threading.Lock()
+    threads = [threading.Thread(target=worker,
+                                args=(storage, users, args.ops, seed, totals, totals_lock))
+               for seed in range(args.threads)]
+    stop = threading.Event()
+    side = threading.Thread(target=during, args=(stop,)) if during else None
+    for thread in threads:
+        thread.start()
+    if side:
+        side.start()
+    for thread in threads:
+        thread.join()
+    stop.set()
+    if side:
+        side.join()
+
+    found = quantities(storage, users)
+    errors = [f"{key}: expected {totals.get(key, 0)}, found {found.get(key, 0)}"
+              for key in set(totals) | set(found) if totals.get(key, 0) != found.get(key, 0)]
+    status = 'ok' if not errors else f"{len(errors)} mismatches"
+    print(f"{name:<24} threads={args.threads} ops={args.ops} users={args.users}  {status}")
+    for error in errors[:10]:
+        print(f"    {error}")
+    return not errors, found
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--ops', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=4)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='stress-')
+    ok = True
+    try:
+        ok &= run('memory', MemoryStorage({}), args)[0]
+
+        snapshot = os.path.join(workdir, 'shopping_data.json')
+        with open(snapshot, 'w') as f:
+            json.dump({'products': {}, 'users': {}}, f)
+        wal = WriteAheadLog(snapshot)
+        wal.load()
+
+        def compact_repeatedly(stop):
+            while not stop.wait(0.01):
+                wal.compact()
+
+        passed, found = run('memory+wal (compacting)', MemoryStorage(wal=wal), args,
+                            during=compact_repeatedly)
+        ok &= passed
+        wal.close()
+
+        replayed = WriteAheadLog(snapshot)
+        replayed.load()
+        users = list(replayed.data['users'])
+        if quantities(MemoryStorage(wal=replayed), users) != found:
+            print("    WAL replay does not match the in-memory state")
+            ok = False
+        else:
+            print("    WAL replay matches the in-memory state")
+
+        ok &= run('sqlite', SQLiteStorage(os.path.join(workdir, 'stress.db')), args)[0]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+import re
+
+# Precompiled lookups over shopping_data['products'] so parsing, adding and
+# searching no longer walk every category on each request.
+
+TOKEN_RE = re.compile(r"[\w'&-]+")
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+def as_product(product):
+    return product if isinstance(product, dict) else {'name': product}
+
+
+def _trigrams(token):
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+
+class CatalogIndex:
+    def __init__(self, products=None):
+        self.version = 0
+        self._clear()
+        if products:
+            self.sync(products)
+
+    def _clear(self):
+        self.by_name = {}      # name -> (category, product)
+        self.variants = {}     # name -> {'brands': {lower: brand}, 'types': {lower: type}}
+        self.order = {}        # name -> insertion ordinal, keeps catalog order stable
+        self.tokens = {}       # token -> set of product names
+        self.token_grams = {}  # trigram -> set of tokens, for substring lookups
+        self._signatures = {}  # name -> (category, repr(product)), used by sync()
+        self._next_ordinal = 0
+
+    def rebuild(self, products):
+        self._clear()
+        self.sync(products)
+
+    def sync(self, products):
+        """Apply only the differences between the index and products."""
+        seen = {}
+        for category, items in products.items():
+            for product in items:
+                product = as_product(product)
+                seen[product['name']] = (category, product)
+
+        changed = False
+        for name in list(self.by_name):
+            if name not in seen:
+                self._remove(name)
+                changed = True
+        for name, (category, product) in seen.items():
+            if self._signatures.get(name) != (category, repr(product)):
+                self._add(category, product)
+                changed = True
+        if changed:
+            self.version += 1
+
+    def add_product(self, category, product):
+        self._add(category, as_product(product))
+        self.version += 1
+
+    def remove_product(self, name):
+        if name in self.by_name:
+            self._remove(name)
+            self.version += 1
+
+    def _add(self, category, product):
+        name = product['name']
+        if name in self.by_name:
+            self._remove(name, keep_order=True)
+        else:
+            self.order[name] = self._next_ordinal
+            self._next_ordinal += 1
+
+        self.by_name[name] = (category, product)
+        self._signatures[name] = (category, repr(product))
+        self.variants[name] = {
+            'brands': {brand.lower(): brand for brand in product.get('brands', [])},
+            'types': {item_type.lower(): item_type for item_type in product.get('types', [])}
+        }
+        for token in tokenize(name):
+            if token not in self.tokens:
+                self.tokens[token] = set()
+                for gram in _trigrams(token):
+                    self.token_grams.setdefault(gram, set()).add(token)
+            self.tokens[token].add(name)
+
+    def _remove(self, name, keep_order=False):
+        self.by_name.pop(name, None)
+        self.variants.pop(name, None)
+        self._signatures.pop(name, None)
+        if not keep_order:
+            self.order.pop(name, None)
+        for token in tokenize(name):
+            names = self.tokens.get(token)
+            if names is None:
+                continue
+            names.discard(name)
+            if not names:
+                del self.tokens[token]
+                for gram in _trigrams(token):
+                    grams = self.token_grams.get(gram)
+                    if grams is not None:
+                        grams.discard(token)
+                        if not grams:
+                            del self.token_grams[gram]
+
+    def lookup(self, name):
+        return self.by_name.get(name)
+
+    def brands(self, name):
+        return self.variants.get(name, {}).get('brands', {})
+
+    def types(self, name):
+        return self.variants.get(name, {}).get('types', {})
+
+    def _sorted(self, names):
+        return sorted(names, key=self.order.__getitem__)
+
+    def _tokens_containing(self, fragment):
+        if len(fragment) < 3:
+            return [token for token in self.tokens if fragment in token]
+        candidates = None
+        for gram in _trigrams(fragment):
+            tokens = self.token_grams.get(gram, set())
+            candidates = tokens if candidates is None else candidates & tokens
+            if not candidates:
+                return []
+        return [token for token in candidates if fragment in token]
+
+    def search(self, query, ordered=True):
+        """Return product names containing query, in catalog order unless ordered=False."""
+        query = query.lower().strip()
+        words = tokenize(query)
+        if not words:
+            return []
+
+        names = None
+        for word in words:
+            matches = set()
+            for token in self._tokens_containing(word):
+                matches.update(self.tokens[token])
+            names = matches if names is None else names & matches
+            if not names:
+                return []
+        if ordered:
+            names = self._sorted(names)
+        return [name for name in names if query in name]
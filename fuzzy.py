@@ -0,0 +1,102 @@
+import os
+
+import numpy as np
+
+# Fuzzy product lookup for misheard or misspelled names ("brad" -> "bread").
+#
+# Every name is reduced to its set of character 2- and 3-grams. The
+# gram -> product incidence matrix is stored column-wise (CSC: one int32
+# postings array plus offsets per gram), so scoring a batch of queries is one
+# concatenation of the postings of their grams and one np.bincount. Scores are
+# Dice coefficients, 2 * shared / (query grams + product grams), in [0, 1].
+
+FUZZY_THRESHOLD = float(os.environ.get('FUZZY_THRESHOLD', '0.6'))
+NGRAM_SIZES = (2, 3)
+
+
+def ngrams(text):
+    padded = f" {' '.join(text.lower().split())} "
+    return {padded[i:i + n] for n in NGRAM_SIZES for i in range(len(padded) - n + 1)}
+
+
+def edit_distance(a, b):
+    previous = list(range(len(b) + 1))
+    for i, char in enumerate(a, 1):
+        current = [i]
+        for j, other in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (char != other)))
+        previous = current
+    return previous[-1]
+
+
+def is_typo(query, name):
+    """Whether query could be a misspelling of name rather than another word.
+
+    N-gram scores alone rank "corn" close to "popcorn" and "cream" close to
+    "ice cream", so a match must also be a couple of typing edits away.
+    """
+    query, name = ' '.join(query.lower().split()), name.lower()
+    return edit_distance(query, name) <= (1 if len(query) <= 5 else 2)
+
+
+class FuzzyIndex:
+    def __init__(self, names):
+        self.names = list(names)
+        self.gram_ids = {}
+        rows, cols = [], []
+        for product_id, name in enumerate(self.names):
+            for gram in ngrams(name):
+                rows.append(self.gram_ids.setdefault(gram, len(self.gram_ids)))
+                cols.append(product_id)
+
+        rows = np.asarray(rows, dtype=np.int32)
+        cols = np.asarray(cols, dtype=np.int32)
+        order = np.argsort(rows, kind='stable')
+        self.postings = cols[order]
+        self.offsets = np.zeros(len(self.gram_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(self.gram_ids)), out=self.offsets[1:])
+        self.sizes = np.bincount(cols, minlength=len(self.names)).astype(np.float32)
+
+    def match_many(self, queries, k=5, threshold=FUZZY_THRESHOLD):
+        """Top-k (name, score) pairs at or above threshold for each query."""
+        n = len(self.names)
+        if not n or not queries:
+            return [[] for _ in queries]
+
+        chunks, query_sizes = [], np.zeros(len(queries), dtype=np.float32)
+        for q, query in enumerate(queries):
+            grams = ngrams(query)
+            query_sizes[q] = len(grams)
+            for gram in grams:
+                gram_id = self.gram_ids.get(gram)
+                if gram_id is not None:
+                    chunk = self.postings[self.offsets[gram_id]:self.offsets[gram_id + 1]]
+                    chunks.append(chunk + q * n)
+        if not chunks:
+            return [[] for _ in queries]
+
+        shared = np.bincount(np.concatenate(chunks), minlength=len(queries) * n)
+        shared = shared.reshape(len(queries), n)
+        scores = 2.0 * shared / (query_sizes[:, None] + self.sizes[None, :])
+        rows, cols = np.nonzero((scores >= threshold) & (shared > 0))
+        bounds = np.searchsorted(rows, np.arange(len(queries) + 1))
+
+        results = []
+        for q in range(len(queries)):
+            candidates = cols[bounds[q]:bounds[q + 1]]
+            candidate_scores = scores[q, candidates]
+            if len(candidates) > k:
+                top = np.argpartition(-candidate_scores, k - 1)[:k]
+                candidates, candidate_scores = candidates[top], candidate_scores[top]
+            # Best score first; ties keep catalog order.
+            order = np.lexsort((candidates, -candidate_scores))
+            results.append([(self.names[candidates[i]], float(candidate_scores[i])) for i in order])
+        return results
+
+    def match(self, query, k=5, threshold=FUZZY_THRESHOLD):
+        return self.match_many([query], k, threshold)[0]
+
+    def best(self, query, threshold=FUZZY_THRESHOLD):
+        matches = self.match(query, 1, threshold)
+        return matches[0] if matches else None
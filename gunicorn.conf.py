@@ -0,0 +1,32 @@
+import gc
+import os
+import threading
+
+# Load the catalog once in the master; workers fork with it already in memory.
+# User lists are loaded in each worker (post_fork), never in the master.
+wsgi_app = 'app:create_app(user_state=False)'
+preload_app = True
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', '1'))
+if workers > 1 and os.environ.get('STORAGE_BACKEND', 'memory') != 'sqlite':
+    # Each worker would keep its own copy of every list and its own WAL
+    # sequence numbers in the same log file.
+    raise SystemExit("WEB_CONCURRENCY > 1 needs STORAGE_BACKEND=sqlite")
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+
+
+def pre_fork(server, worker):
+    # Move everything loaded so far out of the collector's reach, so garbage
+    # collection in the workers doesn't write to (and un-share) those pages.
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    import app
+    app.load_user_state()
+    if os.environ.get('PRELOAD_SPEECH', '0') == '1':
+        # Load the speech models while the worker starts up rather than on its
+        # first voice command. Off by default: text-only workers never need them.
+        threading.Thread(target=app.get_speech_service, daemon=True).start()
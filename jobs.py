@@ -0,0 +1,156 @@
+import os
+import time
+import uuid
+import threading
+from collections import OrderedDict
+
+# Fixed-size background worker pool with a bounded queue. Jobs carry a key:
+# submitting a key that is already queued merges into the pending job, and
+# when the queue is full the oldest job is dropped, since it is the most
+# likely to be stale by the time a worker gets to it.
+
+
+class WorkerPool:
+    def __init__(self, name, workers=2, max_queue=64, stale_after=None, on_drop=None):
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self.stale_after = stale_after
+        self.on_drop = on_drop
+
+        self._cond = threading.Condition()
+        self._pending = OrderedDict()  # key -> (fn, args, enqueued_at)
+        self._pid = None
+        self.counters = {'submitted': 0, 'merged': 0, 'dropped': 0, 'stale': 0,
+                         'completed': 0, 'failed': 0}
+        self.wait_seconds = 0.0
+        self.run_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _ensure_workers(self):
+        # Worker threads do not survive a fork; start them in the process that
+        # actually submits work.
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        for i in range(self.workers):
+            threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True).start()
+
+    def submit(self, key, fn, *args):
+        """Queue fn(*args) under key; returns False if it merged into a pending job."""
+        dropped = None
+        with self._cond:
+            self._ensure_workers()
+            self.counters['submitted'] += 1
+            if key in self._pending:
+                self.counters['merged'] += 1
+                return False
+            if len(self._pending) >= self.max_queue:
+                dropped, _ = self._pending.popitem(last=False)
+                self.counters['dropped'] += 1
+            self._pending[key] = (fn, args, time.monotonic())
+            self._cond.notify()
+
+        if dropped is not None and self.on_drop:
+            self.on_drop(dropped)
+        return True
+
+    def depth(self):
+        with self._cond:
+            return len(self._pending)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                key, (fn, args, enqueued_at) = self._pending.popitem(last=False)
+
+            waited = time.monotonic() - enqueued_at
+            if self.stale_after is not None and waited > self.stale_after:
+                with self._cond:
+                    self.counters['stale'] += 1
+                if self.on_drop:
+                    self.on_drop(key)
+                continue
+
+            started = time.monotonic()
+            try:
+                fn(*args)
+                outcome = 'completed'
+            except Exception as e:
+                print(f"{self.name} job {key} failed: {e}")
+                outcome = 'failed'
+            with self._cond:
+                self.counters[outcome] += 1
+                self.wait_seconds += waited
+                self.run_seconds += time.monotonic() - started
+                self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    def stats(self):
+        with self._cond:
+            done = self.counters['completed'] + self.counters['failed']
+            return dict(self.counters,
+                        depth=len(self._pending),
+                        workers=self.workers,
+                        avg_wait_ms=self.wait_seconds / done * 1000 if done else 0.0,
+                        max_wait_ms=self.max_wait_seconds * 1000,
+                        avg_run_ms=self.run_seconds / done * 1000 if done else 0.0)
+
+
+class JobStore:
+    """In-process registry of submitted jobs that clients poll or stream.
+
+    Jobs live in the worker process that accepted them, so clients must reach
+    the same worker (sticky sessions) when several workers are running.
+    """
+
+    def __init__(self, ttl=300, max_jobs=1024):
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self._cond = threading.Condition()
+        self._jobs = OrderedDict()  # job id -> job dict
+        self._versions = {}         # job id -> bumped on every update
+
+    def create(self, **fields):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._cond:
+            self._expire(now)
+            self._jobs[job_id] = dict(fields, id=job_id, status='queued', created=now)
+            self._versions[job_id] = 0
+        return job_id
+
+    def _expire(self, now):
+        while self._jobs:
+            job_id, job = next(iter(self._jobs.items()))
+            if len(self._jobs) < self.max_jobs and now - job['created'] < self.ttl:
+                break
+            self._jobs.popitem(last=False)
+            self._versions.pop(job_id, None)
+
+    def update(self, job_id, **fields):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.update(fields)
+            self._versions[job_id] += 1
+            self._cond.notify_all()
+
+    def get(self, job_id):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def wait(self, job_id, version, timeout):
+        """Block until the job changes past version; returns (job, version)."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while job_id in self._jobs and self._versions[job_id] == version:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            job = self._jobs.get(job_id)
+            return (dict(job) if job else None), self._versions.get(job_id, version)
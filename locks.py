@@ -0,0 +1,25 @@
+import threading
+import zlib
+from contextlib import contextmanager, ExitStack
+
+# Striped per-key locks: mutations of one user's state serialize on that
+# user's stripe while other users proceed in parallel, without allocating a
+# lock per user.
+
+LOCK_STRIPES = 64
+
+
+class StripedLock:
+    def __init__(self, stripes=LOCK_STRIPES):
+        self._locks = [threading.RLock() for _ in range(stripes)]
+
+    def lock_for(self, key):
+        return self._locks[zlib.crc32(str(key).encode('utf-8')) % len(self._locks)]
+
+    @contextmanager
+    def all(self):
+        """Hold every stripe, always acquired in the same order."""
+        with ExitStack() as stack:
+            for lock in self._locks:
+                stack.enter_context(lock)
+            yield
@@ -0,0 +1,79 @@
+from collections import namedtuple
+
+# Aho-Corasick automaton that finds every vocabulary phrase in a command in a
+# single pass, so parsing cost follows the utterance length rather than the
+# number of keywords, products and brands.
+
+Span = namedtuple('Span', ['start', 'end', 'kind', 'value'])
+
+
+def _is_word_char(ch):
+    # CJK scripts have no spaces between words, so they never form a boundary.
+    return ch.isalnum() and ord(ch) < 0x2E80
+
+
+class Automaton:
+    def __init__(self):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+
+    def add(self, pattern, kind, value):
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append((len(pattern), kind, value))
+
+    def build(self):
+        queue = list(self._goto[0].values())
+        for node in queue:
+            for ch, child in self._goto[node].items():
+                fallback = self._fail[node]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(ch, 0)
+                self._fail[child] = target if target != child else 0
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+                queue.append(child)
+        return self
+
+    def find_all(self, text):
+        """Yield every match that starts and ends on a word boundary."""
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+        last = len(text) - 1
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for length, kind, value in out[node]:
+                start = i - length + 1
+                if start > 0 and _is_word_char(text[start]) and _is_word_char(text[start - 1]):
+                    continue
+                if i < last and _is_word_char(ch) and _is_word_char(text[i + 1]):
+                    continue
+                yield Span(start, i + 1, kind, value)
+
+    def match(self, text):
+        """Return non-overlapping spans, preferring the leftmost-longest per kind."""
+        by_kind = {}
+        for span in self.find_all(text):
+            by_kind.setdefault(span.kind, []).append(span)
+
+        spans = []
+        for candidates in by_kind.values():
+            candidates.sort(key=lambda s: (s.start, s.start - s.end))
+            end = -1
+            for span in candidates:
+                if span.start >= end:
+                    spans.append(span)
+                    end = span.end
+        spans.sort(key=lambda s: s.start)
+        return spans
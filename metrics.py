@@ -0,0 +1,229 @@
+import os
+import time
+import random
+import cProfile
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+# In-process metrics in the Prometheus text format, served at /metrics.
+#
+# Pipeline stages are timed with span(stage) (or the @timed(stage)
+# decorator). Every span feeds the stage_seconds histogram, and while a
+# request is being handled on the current thread it is also added to that
+# request's timings, which app.py sends back as a Server-Timing header.
+#
+# Metrics are per process: with several gunicorn workers each one reports its
+# own numbers.
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+
+REGISTRY = []
+_local = threading.local()
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+        REGISTRY.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labels)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        REGISTRY.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, list(values)) for key, values in self._series.items())
+        for key, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                labels = _format_labels(self.labels, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {values[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {values[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {values[-1]}")
+        return lines
+
+
+class Gauge:
+    """A value read from fn() at scrape time, e.g. a queue depth."""
+
+    def __init__(self, name, description, fn):
+        self.name = name
+        self.description = description
+        self.fn = fn
+        REGISTRY.append(self)
+
+    def render(self):
+        try:
+            value = self.fn()
+        except Exception as e:
+            print(f"Metric {self.name} failed: {e}")
+            return []
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} gauge",
+                f"{self.name} {value}"]
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+STAGE_SECONDS = Histogram('stage_seconds', 'Time spent in each pipeline stage.', ['stage'])
+REQUEST_SECONDS = Histogram('http_request_seconds', 'Request latency by endpoint.', ['endpoint'])
+REQUESTS = Counter('http_requests_total', 'Requests by endpoint and status.',
+                   ['endpoint', 'status'])
+COMMANDS = Counter('commands_total', 'Parsed commands by intent.', ['intent'])
+STT_FAILURES = Counter('stt_failures_total', 'Voice clips that produced no transcript.',
+                       ['reason'])
+SNAPSHOT_SECONDS = Histogram('snapshot_seconds', 'Time to write a full data snapshot.')
+SNAPSHOT_BYTES = Counter('snapshot_bytes_total', 'Bytes written by data snapshots.')
+WAL_BYTES = Counter('wal_bytes_total', 'Bytes appended to the write-ahead log.')
+
+
+def begin_request():
+    _local.timings = {}
+
+
+def end_request():
+    """Stop collecting spans on this thread; returns stage -> seconds."""
+    timings = getattr(_local, 'timings', None)
+    _local.timings = None
+    return timings or {}
+
+
+def record(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = getattr(_local, 'timings', None)
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def span(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
+
+
+def timed(stage):
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            # Inlined rather than using span(): storage calls are hot.
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record(stage, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def server_timing(timings, total=None):
+    entries = [f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in timings.items()]
+    if total is not None:
+        entries.append(f"total;dur={total * 1000:.2f}")
+    return ', '.join(entries)
+
+
+class Profiler:
+    """Profiles a random PROFILE_SAMPLE_RATE share of requests with cProfile.
+
+    Each sampled request is written to PROFILE_DIR as a .prof file for
+    `python -m pstats` or snakeviz. Only one request is profiled at a time.
+    """
+
+    def __init__(self, rate=PROFILE_SAMPLE_RATE, directory=PROFILE_DIR):
+        self.rate = rate
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._active = False
+
+    def start(self):
+        if self.rate <= 0 or random.random() >= self.rate:
+            return None
+        with self._lock:
+            if self._active:
+                return None
+            self._active = True
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e:
+            # Another profiler (e.g. a debugger) is already active.
+            print(f"Profiling skipped: {e}")
+            self._active = False
+            return None
+        return profile
+
+    def stop(self, profile, name):
+        profile.disable()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory,
+                                f"{name}-{int(time.time() * 1000)}-{os.getpid()}.prof")
+            profile.dump_stats(path)
+        except OSError as e:
+            print(f"Could not save profile: {e}")
+        finally:
+            self._active = False
@@ -0,0 +1,455 @@
+import os
+import json
+import threading
+import time
+import atexit
+from datetime import datetime
+from contextlib import contextmanager
+from collections import OrderedDict
+
+from locks import StripedLock
+import metrics
+
+# Append-only write-ahead log for shopping_data.
+#
+# Every mutation is written as one compact JSON line to the log and applied to
+# the in-memory data. The log is flushed and fsynced in groups by a background
+# thread, replayed on startup, and periodically folded into the snapshot file,
+# which is swapped in atomically so a crash can never leave a half-written
+# shopping_data.json behind.
+
+FSYNC_INTERVAL = float(os.environ.get('WAL_FSYNC_INTERVAL', '0.05'))
+FSYNC_BATCH = int(os.environ.get('WAL_FSYNC_BATCH', '64'))
+COMPACT_BYTES = int(os.environ.get('WAL_COMPACT_BYTES', str(4 * 1024 * 1024)))
+
+HISTORY_LIMIT = int(os.environ.get('HISTORY_LIMIT', '50'))
+# Removed lines remembered for delta sync; older clients get the full list.
+TOMBSTONE_LIMIT = int(os.environ.get('LIST_TOMBSTONE_LIMIT', '200'))
+
+META_KEY = '_wal'
+
+
+def new_user():
+    return {'shopping_list': ShoppingList(), 'history': [], 'item_stats': {},
+            'preferences': {}}
+
+
+def item_key(item):
+    return (item['name'], item.get('brand'), item.get('type'), item.get('organic'))
+
+
+def variant(key):
+    name, brand, item_type, organic = key
+    return {'name': name, 'brand': brand, 'type': item_type, 'organic': organic}
+
+
+class ShoppingList:
+    """A user's list lines in insertion order, keyed by variant.
+
+    Lines are indexed by item_key and by name, so merging a line and removing
+    every variant of a name cost the same on a 10-line list and a 10k-line one.
+    Lines are replaced rather than mutated in place, so a shallow copy taken
+    for a snapshot never changes underneath the serializer. Stored as a plain
+    list of lines in shopping_data.json.
+
+    Every change bumps version. The list also remembers when each line was
+    added and last changed, and (up to TOMBSTONE_LIMIT) when lines were
+    removed, so changes_since() can answer delta sync requests.
+    """
+
+    def __init__(self, lines=(), version=0):
+        self.lines = {}
+        self.by_name = {}
+        self.version = version
+        self.versions = OrderedDict()  # key -> (added, changed), least recently changed first
+        self.removed = OrderedDict()   # key -> version it was removed in, oldest first
+        # Removals at or before this version are forgotten; so is everything
+        # before the list was loaded.
+        self.removed_floor = version
+        for line in lines:
+            self._put(line)
+
+    def __iter__(self):
+        return iter(self.lines.values())
+
+    def __len__(self):
+        return len(self.lines)
+
+    def _put(self, item):
+        key = item_key(item)
+        existing = self.lines.get(key)
+        if existing is not None:
+            merged = dict(existing, quantity=existing['quantity'] + item['quantity'])
+            self.lines[key] = merged
+            self.versions[key] = (self.versions[key][0], self.version)
+            self.versions.move_to_end(key)
+            return merged, True
+        self.lines[key] = item
+        self.by_name.setdefault(item['name'], {})[key] = None
+        self.versions[key] = (self.version, self.version)
+        self.removed.pop(key, None)
+        return item, False
+
+    def add(self, item):
+        """Add item or merge it into its variant's line; returns (line, merged)."""
+        self.version += 1
+        return self._put(item)
+
+    def _tombstone(self, key):
+        del self.versions[key]
+        self.removed[key] = self.version
+        while len(self.removed) > TOMBSTONE_LIMIT:
+            _, version = self.removed.popitem(last=False)
+            self.removed_floor = max(self.removed_floor, version)
+
+    def remove_name(self, name, first_only=False):
+        """Remove the lines for name (all variants, oldest first) and return them."""
+        keys = self.by_name.get(name)
+        if not keys:
+            return []
+        if first_only:
+            keys = [next(iter(keys))]
+        self.version += 1
+        removed = []
+        for key in list(keys):
+            removed.append(self.lines.pop(key))
+            del self.by_name[name][key]
+            self._tombstone(key)
+        if not self.by_name[name]:
+            del self.by_name[name]
+        return removed
+
+    def clear(self):
+        if not self.lines:
+            return
+        self.version += 1
+        for key in list(self.lines):
+            self._tombstone(key)
+        # New dicts rather than clear(), for the same reason lines are replaced.
+        self.lines = {}
+        self.by_name = {}
+
+    def changes_since(self, since):
+        """Lines added, changed and removed after version since.
+
+        Returns None when since is too old (or unknown) to answer, in which
+        case the client needs the full list.
+        """
+        if since > self.version or since < self.removed_floor:
+            return None
+        added, changed = [], []
+        for key, (added_in, changed_in) in reversed(self.versions.items()):
+            if changed_in <= since:
+                break
+            (added if added_in > since else changed).append(self.lines[key])
+        removed = []
+        for key, version in reversed(self.removed.items()):
+            if version <= since:
+                break
+            removed.append(variant(key))
+        # Added lines in list order, so clients can append them.
+        added.sort(key=lambda line: self.versions[item_key(line)][0])
+        return {'version': self.version, 'added': added, 'changed': changed[::-1],
+                'removed': removed[::-1]}
+
+    def to_list(self):
+        return list(self.lines.values())
+
+
+def _parse_time(value):
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def bump_item_stats(stats, item):
+    """Return stats (or None) for item['name'] with one more purchase rolled in.
+
+    Tracks the purchase count, total quantity, last purchase time and the
+    running mean of the intervals between purchases, in seconds.
+    """
+    if stats is None:
+        return {'count': 1, 'quantity': item.get('quantity', 1),
+                'last_bought': item.get('added_on'), 'avg_interval': None}
+
+    avg_interval = stats['avg_interval']
+    bought, last = _parse_time(item.get('added_on')), _parse_time(stats['last_bought'])
+    if bought is not None and last is not None:
+        interval = max(0.0, bought - last)
+        intervals = stats['count'] - 1
+        avg_interval = (interval if avg_interval is None
+                        else (avg_interval * intervals + interval) / (intervals + 1))
+    return {'count': stats['count'] + 1,
+            'quantity': stats['quantity'] + item.get('quantity', 1),
+            'last_bought': item.get('added_on') or stats['last_bought'],
+            'avg_interval': avg_interval}
+
+
+def _get_user(users, user_id):
+    return upgrade_user(users.setdefault(user_id, new_user()))
+
+
+def upgrade_user(user):
+    """Bring a user loaded from shopping_data.json up to the in-memory layout."""
+    if not isinstance(user['shopping_list'], ShoppingList):
+        # Loaded from JSON as a plain list.
+        user['shopping_list'] = ShoppingList(user['shopping_list'], user.pop('list_version', 0))
+    if 'item_stats' not in user:
+        # Written before history was capped: roll the full history up once.
+        stats = {}
+        for item in user['history']:
+            stats[item['name']] = bump_item_stats(stats.get(item['name']), item)
+        user['item_stats'] = stats
+        del user['history'][:max(0, len(user['history']) - HISTORY_LIMIT)]
+    return user
+
+
+def snapshot_user(user):
+    copy = {}
+    for key, value in user.items():
+        if isinstance(value, ShoppingList):
+            copy['list_version'] = value.version
+            value = value.to_list()
+        elif isinstance(value, list):
+            value = list(value)
+        elif isinstance(value, dict):
+            value = dict(value)
+        copy[key] = value
+    return copy
+
+
+def apply_record(data, record):
+    op = record['op']
+    users = data.setdefault('users', {})
+
+    if op == 'init_user':
+        _get_user(users, record['user'])
+        return None
+
+    if op == 'batch':
+        return [apply_record(data, inner) for inner in record['ops']]
+
+    user = _get_user(users, record['user'])
+    shopping_list = user['shopping_list']
+
+    if op == 'add_item':
+        return shopping_list.add(record['item'])[0]
+    elif op == 'remove_name':
+        return shopping_list.remove_name(record['name'])
+    elif op == 'remove_item':
+        # Logs written before remove_name removed only the oldest variant.
+        removed = shopping_list.remove_name(record['name'], first_only=True)
+        return removed[0] if removed else None
+    elif op == 'clear_list':
+        shopping_list.clear()
+        return None
+    elif op == 'add_history':
+        # history is a capped window of recent events; item_stats keeps the
+        # totals. Stats entries are replaced, never mutated (see ShoppingList).
+        item = record['item']
+        history = user['history']
+        history.append(item)
+        del history[:max(0, len(history) - HISTORY_LIMIT)]
+        stats = user['item_stats']
+        stats[item['name']] = bump_item_stats(stats.get(item['name']), item)
+        return None
+
+    raise ValueError(f"Unknown log record: {op}")
+
+
+class WriteAheadLog:
+    def __init__(self, snapshot_file, log_file=None):
+        self.snapshot_file = snapshot_file
+        self.log_file = log_file or os.path.splitext(snapshot_file)[0] + '.log'
+        self.old_log_file = self.log_file + '.old'
+        self.data = None
+        self.seq = 0
+
+        # Lock order: a user's stripe in self.locks, then self._lock, which
+        # only guards the log file and sequence numbers.
+        self.locks = StripedLock()
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._local = threading.local()
+        self._fh = None
+        self._pid = None
+        self._pending = 0
+        self._log_bytes = 0
+        self._compacting = False
+        self._closed = False
+
+    def load(self):
+        with open(self.snapshot_file, 'r') as f:
+            data = json.load(f)
+        meta = data.pop(META_KEY, {})
+        self.seq = meta.get('seq', 0)
+
+        # A leftover .old log means we crashed mid-compaction; records the
+        # snapshot already contains are skipped by sequence number.
+        for path in (self.old_log_file, self.log_file):
+            self._replay(data, path)
+
+        if os.path.exists(self.log_file):
+            self._log_bytes = os.path.getsize(self.log_file)
+        self.data = data
+        return data
+
+    def _replay(self, data, path):
+        if not os.path.exists(path):
+            return
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Torn final write from a crash; nothing after it was acked.
+                    print(f"Ignoring truncated log record in {path}")
+                    break
+                if record['seq'] <= self.seq:
+                    continue
+                apply_record(data, record)
+                self.seq = record['seq']
+
+    def record(self, op, **fields):
+        with self.locks.lock_for(fields.get('user')):
+            record = dict(fields, op=op)
+            result = apply_record(self.data, record)
+
+            batch = getattr(self._local, 'batch', None)
+            if batch is not None:
+                # Serialize now: later ops in the batch may replace the same line.
+                batch.append(self._encode(record))
+                return result
+
+            with self._lock:
+                self.seq += 1
+                record['seq'] = self.seq
+                self._write(self._encode(record))
+            return result
+
+    @contextmanager
+    def batch(self, user_id):
+        """Hold user_id's lock and log the enclosed records as one atomic line."""
+        with self.locks.lock_for(user_id):
+            if getattr(self._local, 'batch', None) is not None:
+                yield
+                return
+            self._local.batch = []
+            try:
+                yield
+            finally:
+                ops, self._local.batch = self._local.batch, None
+                # Whatever was applied in memory must reach the log, even if
+                # the block raised halfway through.
+                if ops:
+                    with self._lock:
+                        self.seq += 1
+                        self._write(f'{{"op":"batch","seq":{self.seq},"ops":[{",".join(ops)}]}}')
+
+    @staticmethod
+    def _encode(record):
+        return json.dumps(record, separators=(',', ':'), ensure_ascii=False)
+
+    def _write(self, encoded):
+        self._ensure_open()
+        line = encoded + '\n'
+        self._fh.write(line)
+        self._pending += 1
+        self._log_bytes += len(line)
+        metrics.WAL_BYTES.inc(len(line))
+
+        if self._pending >= FSYNC_BATCH or self._log_bytes >= COMPACT_BYTES:
+            self._wake.notify()
+
+    def _ensure_open(self):
+        # Threads and file handles do not survive a fork, so (re)start them
+        # lazily in whichever process actually writes.
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._fh = open(self.log_file, 'a', encoding='utf-8')
+        self._pending = 0
+        threading.Thread(target=self._flusher, daemon=True).start()
+        atexit.register(self.close)
+
+    def _flusher(self):
+        pid = os.getpid()
+        with self._lock:
+            while not self._closed and self._pid == pid:
+                self._wake.wait(FSYNC_INTERVAL)
+                if self._pending:
+                    self._sync()
+                if self._log_bytes >= COMPACT_BYTES and not self._compacting:
+                    self._compacting = True
+                    threading.Thread(target=self.compact, daemon=True).start()
+
+    def _sync(self):
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+        self._pending = 0
+
+    def compact(self):
+        # With every stripe held, everything applied in memory has also been
+        # logged, so the copy below matches self.seq exactly. The copy is
+        # shallow: lines are never mutated in place, so serializing it outside
+        # the locks is safe.
+        with self.locks.all(), self._lock:
+            self._compacting = True
+            try:
+                if self._fh:
+                    self._sync()
+                    self._fh.close()
+                if os.path.exists(self.log_file) and not os.path.exists(self.old_log_file):
+                    os.replace(self.log_file, self.old_log_file)
+                if self._fh:
+                    self._fh = open(self.log_file, 'a', encoding='utf-8')
+                self._log_bytes = 0
+
+                snapshot = dict(self.data)
+                snapshot['users'] = {user_id: snapshot_user(user)
+                                     for user_id, user in self.data.get('users', {}).items()}
+                snapshot[META_KEY] = {'seq': self.seq}
+            except Exception:
+                self._compacting = False
+                raise
+
+        try:
+            start = time.perf_counter()
+            payload = self._encode(snapshot)
+            self._write_snapshot(payload)
+            metrics.SNAPSHOT_SECONDS.observe(time.perf_counter() - start)
+            metrics.SNAPSHOT_BYTES.inc(os.path.getsize(self.snapshot_file))
+            if os.path.exists(self.old_log_file):
+                os.remove(self.old_log_file)
+        except Exception as e:
+            print(f"Snapshot compaction failed: {e}")
+        finally:
+            self._compacting = False
+
+    def _write_snapshot(self, payload):
+        directory = os.path.dirname(os.path.abspath(self.snapshot_file))
+        tmp_file = self.snapshot_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.snapshot_file)
+
+        # Make the rename itself durable.
+        if hasattr(os, 'O_DIRECTORY'):
+            fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            if self._fh and self._pid == os.getpid():
+                try:
+                    self._sync()
+                except ValueError:
+                    pass
+            self._wake.notify_all()
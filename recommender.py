@@ -0,0 +1,107 @@
+import os
+import json
+import heapq
+import threading
+
+# "Frequently bought together" recommendations from a sparse item-item
+# co-occurrence matrix. Every add counts one co-occurrence between the new
+# item and each item already in the basket, and the top-k neighbour list of
+# every touched row is kept up to date, so a query is a single dict lookup.
+#
+# The matrix is rebuilt offline from all users' lists and history with
+# `flask rebuild-recommendations` and loaded at startup; adds seen by a worker
+# after that are folded in incrementally in that worker.
+
+NEIGHBORS = int(os.environ.get('RECOMMENDER_NEIGHBORS', '10'))
+
+
+def _rank(entry):
+    # Most co-occurrences first, ties alphabetically.
+    return -entry[0], entry[1]
+
+
+def history_baskets(history):
+    """Group history events bought on the same day into baskets."""
+    baskets = {}
+    for item in history:
+        day = (item.get('added_on') or '')[:10]
+        baskets.setdefault(day, []).append(item['name'])
+    return list(baskets.values())
+
+
+class CoOccurrence:
+    def __init__(self, neighbors=NEIGHBORS):
+        self.k = neighbors
+        self.counts = {}     # item -> {other item -> times bought together}
+        self.neighbors = {}  # item -> [(count, other item)], best first, at most k
+        self._lock = threading.Lock()
+
+    def _bump(self, item, other):
+        row = self.counts.setdefault(item, {})
+        row[other] = row.get(other, 0) + 1
+        return row[other]
+
+    def _refresh(self, item):
+        row = self.counts.get(item, {})
+        self.neighbors[item] = heapq.nsmallest(self.k, ((n, other) for other, n in row.items()),
+                                               key=_rank)
+
+    def _promote(self, item, other, count):
+        # Counts only grow, so other can only move up this row's ranking and
+        # the list can be patched without rescanning the row.
+        top = [entry for entry in self.neighbors.get(item, []) if entry[1] != other]
+        entry = (count, other)
+        if len(top) >= self.k and _rank(entry) > _rank(top[-1]):
+            return
+        top.append(entry)
+        top.sort(key=_rank)
+        self.neighbors[item] = top[:self.k]
+
+    def observe(self, item, basket):
+        """Record that item was added alongside the items in basket."""
+        others = {other for other in basket if other != item}
+        if not others:
+            return
+        with self._lock:
+            for other in others:
+                self._promote(item, other, self._bump(item, other))
+                self._promote(other, item, self._bump(other, item))
+
+    def related(self, item, k=None):
+        """Items most often bought together with item, best first."""
+        top = self.neighbors.get(item)
+        return [other for _, other in top[:k or self.k]] if top else []
+
+    def rebuild(self, baskets):
+        counts = {}
+        for basket in baskets:
+            names = sorted(set(basket))
+            for i, item in enumerate(names):
+                row = counts.setdefault(item, {})
+                for other in names[:i] + names[i + 1:]:
+                    row[other] = row.get(other, 0) + 1
+        self.load_counts(counts)
+
+    def load_counts(self, counts):
+        with self._lock:
+            self.counts = counts
+            self.neighbors = {}
+            for item in counts:
+                self._refresh(item)
+
+    def save(self, path):
+        tmp_file = path + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({'counts': self.counts}, f, separators=(',', ':'))
+        os.replace(tmp_file, path)
+
+    def load(self, path):
+        if not os.path.exists(path):
+            return False
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.load_counts(json.load(f)['counts'])
+            return True
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Could not load recommendations from {path}: {e}")
+            return False
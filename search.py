@@ -0,0 +1,156 @@
+import numpy as np
+
+# Faceted catalog search. Products are numbered in catalog order and every
+# facet value (category, brand, type, organic) is a bitset over those numbers,
+# stored as a Python int so intersections are a single `&`. Price ranges are
+# two binary searches over a sorted price array. The result bitset is expanded
+# back to product numbers only once, for sorting and pagination.
+
+SORTS = ('relevance', 'price', '-price', 'name')
+MAX_PER_PAGE = 100
+
+
+def _to_bitset(mask):
+    return int.from_bytes(np.packbits(mask, bitorder='little').tobytes(), 'little')
+
+
+def _from_bitset(bits, size):
+    raw = np.frombuffer(bits.to_bytes((size + 7) // 8, 'little'), dtype=np.uint8)
+    return np.flatnonzero(np.unpackbits(raw, bitorder='little')[:size])
+
+
+class CatalogSearch:
+    def __init__(self, catalog, fuzzy=None):
+        self.catalog = catalog
+        self.fuzzy = fuzzy
+        self.names = sorted(catalog.by_name, key=catalog.order.__getitem__)
+        self.ids = {name: i for i, name in enumerate(self.names)}
+        size = self.size = len(self.names)
+
+        self.prices = np.full(size, np.nan)
+        self.name_lengths = np.array([len(name) for name in self.names], dtype=np.float64)
+        facets = {'categories': {}, 'brands': {}, 'types': {}}
+        organic, no_brands, no_types = [], [], []
+        for i, name in enumerate(self.names):
+            category, product = catalog.by_name[name]
+            facets['categories'].setdefault(category, []).append(i)
+            if 'price' in product:
+                self.prices[i] = product['price']
+            if 'brands' in product:
+                for brand in product['brands']:
+                    facets['brands'].setdefault(brand.lower(), []).append(i)
+            else:
+                no_brands.append(i)
+            if 'types' in product:
+                for item_type in product['types']:
+                    facets['types'].setdefault(item_type.lower(), []).append(i)
+            else:
+                no_types.append(i)
+            if 'organic' in name.lower():
+                organic.append(i)
+
+        self.all = (1 << size) - 1
+        self.facets = {facet: {value: self._bitset(ids) for value, ids in values.items()}
+                       for facet, values in facets.items()}
+        self.organic = self._bitset(organic)
+        # Products that do not list brands or types are not excluded by those
+        # filters, nor unpriced products by a price range.
+        self.no_brands = self._bitset(no_brands)
+        self.no_types = self._bitset(no_types)
+
+        priced = np.flatnonzero(~np.isnan(self.prices))
+        order = np.argsort(self.prices[priced], kind='stable')
+        self.price_ids = priced[order]
+        self.sorted_prices = self.prices[self.price_ids]
+        self.unpriced = self.all & ~self._bitset(priced)
+
+    def _bitset(self, ids):
+        mask = np.zeros(self.size, dtype=bool)
+        mask[np.asarray(ids, dtype=np.int64)] = True
+        return _to_bitset(mask)
+
+    def _price_range(self, min_price, max_price):
+        lo = 0 if min_price is None else np.searchsorted(self.sorted_prices, min_price, 'left')
+        hi = (len(self.sorted_prices) if max_price is None
+              else np.searchsorted(self.sorted_prices, max_price, 'right'))
+        return self._bitset(self.price_ids[lo:hi]) | self.unpriced
+
+    def _any_of(self, facet, values):
+        index = self.facets[facet]
+        bits = 0
+        for value in values:
+            bits |= index.get(value.lower(), 0)
+        return bits
+
+    def _relevance(self, query):
+        """Per-product relevance to query, 0 where it does not match."""
+        query = query.lower().strip()
+        scores = np.zeros(self.size)
+        names = self.catalog.search(query, ordered=False)
+        if names:
+            ids = np.fromiter((self.ids[name] for name in names), dtype=np.int64, count=len(names))
+            # Substring matches score 1 plus the share of the name matched (2 for
+            # an exact name), which keeps them above fuzzy matches.
+            scores[ids] = 1.0 + len(query) / self.name_lengths[ids]
+        elif self.fuzzy is not None:
+            for name, score in self.fuzzy.match(query, k=20):
+                scores[self.ids[name]] = score
+        return scores
+
+    def search(self, query=None, categories=(), brands=(), types=(), organic=False,
+               min_price=None, max_price=None, sort='relevance', page=1, per_page=10):
+        if sort not in SORTS:
+            raise ValueError(f"Unknown sort: {sort}")
+        page = max(1, int(page))
+        per_page = max(1, min(MAX_PER_PAGE, int(per_page)))
+
+        bits = self.all
+        scores = None
+        if query:
+            scores = self._relevance(query)
+            bits &= _to_bitset(scores > 0)
+        if categories:
+            bits &= self._any_of('categories', categories)
+        if brands:
+            bits &= self._any_of('brands', brands) | self.no_brands
+        if types:
+            bits &= self._any_of('types', types) | self.no_types
+        if organic:
+            bits &= self.organic
+        if min_price is not None or max_price is not None:
+            bits &= self._price_range(min_price, max_price)
+
+        ids = _from_bitset(bits, self.size)
+        if sort == 'relevance' and scores is not None:
+            ids = ids[np.lexsort((ids, -scores[ids]))]
+        elif sort in ('price', '-price'):
+            prices = self.prices[ids]
+            direction = 1 if sort == 'price' else -1
+            # Unpriced products go last either way.
+            ids = ids[np.lexsort((ids, np.nan_to_num(prices * direction, nan=np.inf)))]
+        elif sort == 'name':
+            ids = np.array(sorted(ids, key=self.names.__getitem__), dtype=np.int64)
+
+        start = (page - 1) * per_page
+        results = []
+        for i in ids[start:start + per_page]:
+            category, product = self.catalog.by_name[self.names[i]]
+            result = {'name': self.names[i], 'category': category}
+            for key in ('price', 'brands', 'types'):
+                if key in product:
+                    result[key] = product[key]
+            if scores is not None:
+                result['score'] = round(float(scores[i]), 3)
+            results.append(result)
+
+        return {
+            'total': len(ids),
+            'page': page,
+            'per_page': per_page,
+            'results': results,
+            'facets': {
+                'categories': {category: (bits & category_bits).bit_count()
+                               for category, category_bits in self.facets['categories'].items()
+                               if bits & category_bits},
+            },
+        }
@@ -0,0 +1,263 @@
+import os
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import speech_recognition as sr
+
+try:
+    import vosk
+except ImportError:
+    vosk = None
+
+# Speech-to-text engines behind one interface. Engines are created once per
+# worker process and keep their models warm; recognition runs on a bounded
+# executor so a slow engine can only tie up STT_WORKERS threads.
+
+STT_WORKERS = int(os.environ.get('STT_WORKERS', '2'))
+STT_TIMEOUT = float(os.environ.get('STT_TIMEOUT', '10'))
+
+
+class RecognitionError(Exception):
+    pass
+
+
+class RecognizerEngine:
+    name = 'base'
+    sample_rate = 16000
+
+    def __init__(self, timeout=STT_TIMEOUT):
+        self.timeout = timeout
+
+    def load(self):
+        """Load models up front so the first request does not pay for it."""
+
+    def set_vocabulary(self, phrases):
+        """Restrict decoding to phrases; engines that cannot do this ignore it."""
+
+    def recognize(self, pcm, sample_rate):
+        """Return the transcript, or None when nothing intelligible was said."""
+        raise NotImplementedError
+
+    def open_stream(self, sample_rate):
+        """Return an incremental recognizer; by default it buffers until finish()."""
+        return BufferedStream(self, sample_rate)
+
+
+class BufferedStream:
+    """Streaming adapter for engines that can only recognize whole clips."""
+
+    def __init__(self, engine, sample_rate):
+        self.engine = engine
+        self.sample_rate = sample_rate
+        self._chunks = []
+
+    def accept(self, pcm):
+        """Feed audio; returns the current partial transcript."""
+        self._chunks.append(pcm)
+        return ''
+
+    def finish(self):
+        return self.engine.recognize(b''.join(self._chunks), self.sample_rate)
+
+
+class GoogleEngine(RecognizerEngine):
+    name = 'google'
+
+    def __init__(self, timeout=STT_TIMEOUT):
+        super().__init__(timeout)
+        self._recognizer = sr.Recognizer()
+        self._recognizer.operation_timeout = timeout
+
+    def recognize(self, pcm, sample_rate):
+        try:
+            return self._recognizer.recognize_google(sr.AudioData(pcm, sample_rate, 2))
+        except sr.UnknownValueError:
+            return None
+        except sr.RequestError as e:
+            raise RecognitionError(str(e))
+
+
+class VoskEngine(RecognizerEngine):
+    name = 'vosk'
+
+    def __init__(self, model_path=None, timeout=STT_TIMEOUT):
+        super().__init__(timeout)
+        self.model_path = model_path or os.environ.get('VOSK_MODEL_PATH', 'models/vosk')
+        self._model = None
+        self._grammar = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    if vosk is None:
+                        raise RecognitionError("vosk is not installed")
+                    vosk.SetLogLevel(-1)
+                    self._model = vosk.Model(self.model_path)
+        return self._model
+
+    def set_vocabulary(self, phrases):
+        # Grammars need a model with a dynamic graph (the "small" Vosk models).
+        self._grammar = json.dumps(list(phrases) + ['[unk]']) if phrases else None
+
+    def recognize(self, pcm, sample_rate):
+        if self._grammar:
+            recognizer = vosk.KaldiRecognizer(self.load(), sample_rate, self._grammar)
+        else:
+            recognizer = vosk.KaldiRecognizer(self.load(), sample_rate)
+        recognizer.AcceptWaveform(pcm)
+        text = json.loads(recognizer.FinalResult()).get('text', '')
+        return text or None
+
+    def open_stream(self, sample_rate):
+        if self._grammar:
+            recognizer = vosk.KaldiRecognizer(self.load(), sample_rate, self._grammar)
+        else:
+            recognizer = vosk.KaldiRecognizer(self.load(), sample_rate)
+        return VoskStream(recognizer)
+
+
+class VoskStream:
+    def __init__(self, recognizer):
+        self._recognizer = recognizer
+        self._segments = []
+
+    def _text(self, partial=''):
+        return ' '.join(self._segments + ([partial] if partial else []))
+
+    def accept(self, pcm):
+        if self._recognizer.AcceptWaveform(pcm):
+            segment = json.loads(self._recognizer.Result()).get('text', '')
+            if segment:
+                self._segments.append(segment)
+            return self._text()
+        return self._text(json.loads(self._recognizer.PartialResult()).get('partial', ''))
+
+    def finish(self):
+        return self._text(json.loads(self._recognizer.FinalResult()).get('text', '')) or None
+
+
+class StubEngine(RecognizerEngine):
+    """Deterministic engine for tests: maps audio digests to fixed transcripts."""
+
+    name = 'stub'
+
+    def __init__(self, transcripts=None, default=None, timeout=STT_TIMEOUT):
+        super().__init__(timeout)
+        self.transcripts = dict(transcripts or {})
+        self.default = default if default is not None else os.environ.get('STT_STUB_TEXT')
+        # A JSON object of digest -> transcript, e.g. for audio fixtures
+        # replayed against a separate server process.
+        path = os.environ.get('STT_STUB_TRANSCRIPTS')
+        if transcripts is None and path:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.transcripts.update(json.load(f))
+
+    @staticmethod
+    def digest(pcm):
+        return hashlib.sha1(pcm).hexdigest()
+
+    def recognize(self, pcm, sample_rate):
+        return self.transcripts.get(self.digest(pcm), self.default)
+
+    def open_stream(self, sample_rate):
+        return StubStream(self, sample_rate)
+
+
+class StubStream(BufferedStream):
+    """Reveals the stub transcript one word per chunk, like a real partial."""
+
+    def accept(self, pcm):
+        super().accept(pcm)
+        words = (self.engine.default or '').split()
+        return ' '.join(words[:len(self._chunks)])
+
+
+ENGINES = {
+    'google': GoogleEngine,
+    'vosk': VoskEngine,
+    'stub': StubEngine,
+}
+
+
+class SpeechService:
+    """Runs engines in order until one produces a transcript."""
+
+    def __init__(self, engines, workers=STT_WORKERS):
+        self.engines = engines
+        self._executor = ThreadPoolExecutor(max_workers=workers,
+                                            thread_name_prefix='stt')
+
+    def set_vocabulary(self, phrases):
+        for engine in self.engines:
+            engine.set_vocabulary(phrases)
+
+    def warm(self):
+        for engine in self.engines:
+            try:
+                engine.load()
+            except Exception as e:
+                print(f"Could not load {engine.name} speech engine: {e}")
+
+    def open_stream(self, sample_rate):
+        return self.engines[0].open_stream(sample_rate)
+
+    def finish_stream(self, stream):
+        """Finalize a stream under the first engine's timeout; same results as recognize()."""
+        future = self._executor.submit(stream.finish)
+        try:
+            text = future.result(self.engines[0].timeout)
+        except TimeoutError:
+            return "timeout"
+        except Exception as e:
+            print(f"Streaming recognition error: {e}")
+            return "error"
+        return text.lower() if text else "unknown"
+
+    def recognize(self, pcm, sample_rate):
+        """Return a lowercase transcript or one of "unknown", "timeout", "error"."""
+        status = "error"
+        for engine in self.engines:
+            future = self._executor.submit(engine.recognize, pcm, sample_rate)
+            try:
+                text = future.result(engine.timeout)
+            except TimeoutError:
+                print(f"Speech recognition timed out in {engine.name}")
+                status = "timeout"
+                continue
+            except Exception as e:
+                print(f"Speech recognition error in {engine.name}: {e}")
+                continue
+            if not text:
+                return "unknown"
+            print(f"Recognized: {text}")
+            return text.lower()
+        return status
+
+
+def create_speech_service(names=None):
+    names = names or os.environ.get('STT_ENGINE', 'google')
+    engines = [ENGINES[name.strip()]() for name in names.split(',') if name.strip()]
+    return SpeechService(engines)
+
+
+class StablePrefix:
+    """Tracks the words that stayed the same across the last few partials."""
+
+    def __init__(self, window=3):
+        self.window = window
+        self._history = []
+
+    def update(self, partial):
+        self._history = (self._history + [partial.split()])[-self.window:]
+        if len(self._history) < self.window:
+            return ''
+        prefix = []
+        for words in zip(*self._history):
+            if any(word != words[0] for word in words):
+                break
+            prefix.append(words[0])
+        return ' '.join(prefix)
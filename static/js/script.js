@@ -10,9 +10,20 @@ document.addEventListener("DOMContentLoaded", function () {
   const clearListButton = document.getElementById("clear-list");
 
   let recognition = null;
+  let mediaRecorder = null;
+  let voiceSocket = null;
   let isListening = false;
+  // The list as last synced, keyed by variant, and its server version.
+  const listItems = new Map();
+  let listVersion = null;
+  let listEvents = null;
 
   loadShoppingList();
+  document.addEventListener("visibilitychange", () => {
+    if (document.visibilityState === "visible" && !listEvents) {
+      loadShoppingList();
+    }
+  });
 
   micButton.addEventListener("click", function () {
     if (isListening) {
@@ -38,6 +49,7 @@ document.addEventListener("DOMContentLoaded", function () {
         .then((response) => response.json())
         .then((data) => {
           showResponse(data.response);
+          playResponse(data.audio_url);
           loadShoppingList();
         });
     }
@@ -53,7 +65,13 @@ document.addEventListener("DOMContentLoaded", function () {
     if (
       !("webkitSpeechRecognition" in window || "SpeechRecognition" in window)
     ) {
-      alert("Sorry, your browser does not support speech recognition.");
+      if (window.WebSocket && window.AudioContext && navigator.mediaDevices) {
+        startStreaming();
+      } else if (window.MediaRecorder && navigator.mediaDevices) {
+        startRecording();
+      } else {
+        alert("Sorry, your browser does not support speech recognition.");
+      }
       return;
     }
 
@@ -88,10 +106,189 @@ document.addEventListener("DOMContentLoaded", function () {
     recognition.start();
   }
 
+  // Browsers without the Web Speech API stream microphone audio to the server,
+  // which sends back partial transcripts and ends the utterance itself.
+  function startStreaming() {
+    navigator.mediaDevices
+      .getUserMedia({ audio: true })
+      .then((stream) => {
+        const scheme = location.protocol === "https:" ? "wss://" : "ws://";
+        const socket = new WebSocket(scheme + location.host + "/voice-stream");
+        const context = new AudioContext();
+        const source = context.createMediaStreamSource(stream);
+        const processor = context.createScriptProcessor(4096, 1, 1);
+        let opened = false;
+
+        const release = () => {
+          processor.disconnect();
+          source.disconnect();
+          stream.getTracks().forEach((track) => track.stop());
+          context.close();
+          voiceSocket = null;
+          isListening = false;
+          micButton.classList.remove("listening");
+          statusText.textContent = "Click the microphone to speak";
+        };
+
+        processor.onaudioprocess = (event) => {
+          if (socket.readyState === WebSocket.OPEN) {
+            socket.send(
+              downsampleTo16k(event.inputBuffer.getChannelData(0), context.sampleRate)
+            );
+          }
+        };
+
+        socket.binaryType = "arraybuffer";
+        socket.onopen = () => {
+          opened = true;
+          voiceSocket = socket;
+          source.connect(processor);
+          processor.connect(context.destination);
+          isListening = true;
+          micButton.classList.add("listening");
+          statusText.textContent = "Listening...";
+        };
+        socket.onmessage = (event) => {
+          const message = JSON.parse(event.data);
+          if (message.type === "partial" && message.transcript) {
+            showResponse("Heard: " + message.transcript);
+          } else if (message.type === "intent") {
+            statusText.textContent = `Got it: ${message.intent} ${message.item || ""}`;
+          } else if (message.type === "response") {
+            showResponse(message.response);
+            playResponse(message.audio_url);
+            loadShoppingList();
+          }
+        };
+        socket.onclose = () => {
+          release();
+          if (!opened && window.MediaRecorder) {
+            startRecording();
+          }
+        };
+      })
+      .catch((error) => {
+        showResponse("Error: " + error.message);
+      });
+  }
+
+  function downsampleTo16k(samples, sampleRate) {
+    const ratio = sampleRate / 16000;
+    const output = new Int16Array(Math.floor(samples.length / ratio));
+    for (let i = 0; i < output.length; i++) {
+      const sample = Math.max(-1, Math.min(1, samples[Math.floor(i * ratio)]));
+      output[i] = sample < 0 ? sample * 0x8000 : sample * 0x7fff;
+    }
+    return output.buffer;
+  }
+
+  // Without WebSocket support, record the clip and let the server transcribe
+  // it as a background job.
+  function startRecording() {
+    navigator.mediaDevices
+      .getUserMedia({ audio: true })
+      .then((stream) => {
+        const chunks = [];
+        mediaRecorder = new MediaRecorder(stream);
+        mediaRecorder.ondataavailable = (event) => chunks.push(event.data);
+        mediaRecorder.onstop = () => {
+          stream.getTracks().forEach((track) => track.stop());
+          sendVoiceCommand(new Blob(chunks, { type: mediaRecorder.mimeType }));
+          mediaRecorder = null;
+        };
+        mediaRecorder.start();
+        isListening = true;
+        micButton.classList.add("listening");
+        statusText.textContent = "Listening... click again to stop";
+        setTimeout(() => {
+          if (mediaRecorder && mediaRecorder.state === "recording") {
+            stopListening();
+          }
+        }, 6000);
+      })
+      .catch((error) => {
+        showResponse("Error: " + error.message);
+      });
+  }
+
+  function sendVoiceCommand(blob) {
+    showResponse("Processing...");
+    const reader = new FileReader();
+    reader.onloadend = () => {
+      fetch("/voice-command", {
+        method: "POST",
+        headers: {
+          "Content-Type": "application/json",
+        },
+        body: JSON.stringify({ audio: reader.result, async: true }),
+      })
+        .then((response) => response.json())
+        .then((job) => followVoiceJob(job))
+        .catch((error) => {
+          showResponse("Error: " + error.message);
+        });
+    };
+    reader.readAsDataURL(blob);
+  }
+
+  function followVoiceJob(job) {
+    const finish = (data) => {
+      showResponse(data.response || data.error);
+      playResponse(data.audio_url);
+      loadShoppingList();
+    };
+
+    if (!window.EventSource) {
+      pollVoiceJob(job.status_url, finish);
+      return;
+    }
+
+    const events = new EventSource(job.events_url);
+    events.addEventListener("transcript", (event) => {
+      showResponse("Heard: " + JSON.parse(event.data).transcript);
+    });
+    events.addEventListener("done", (event) => {
+      events.close();
+      finish(JSON.parse(event.data));
+    });
+    events.addEventListener("failed", (event) => {
+      events.close();
+      finish(JSON.parse(event.data));
+    });
+    events.onerror = () => {
+      events.close();
+      pollVoiceJob(job.status_url, finish);
+    };
+  }
+
+  function pollVoiceJob(statusUrl, finish) {
+    fetch(statusUrl)
+      .then((response) => response.json())
+      .then((data) => {
+        if (data.status === "done" || data.status === "failed") {
+          finish(data);
+          return;
+        }
+        if (data.transcript) {
+          showResponse("Heard: " + data.transcript);
+        }
+        setTimeout(() => pollVoiceJob(statusUrl, finish), 500);
+      })
+      .catch((error) => {
+        showResponse("Error: " + error.message);
+      });
+  }
+
   function stopListening() {
     if (recognition) {
       recognition.stop();
     }
+    if (mediaRecorder && mediaRecorder.state === "recording") {
+      mediaRecorder.stop();
+    }
+    if (voiceSocket && voiceSocket.readyState === WebSocket.OPEN) {
+      voiceSocket.send(JSON.stringify({ type: "stop" }));
+    }
     isListening = false;
     micButton.classList.remove("listening");
     statusText.textContent = "Click the microphone to speak";
@@ -110,6 +307,7 @@ document.addEventListener("DOMContentLoaded", function () {
       .then((response) => response.json())
       .then((data) => {
         showResponse(data.response);
+        playResponse(data.audio_url);
         loadShoppingList();
       })
       .catch((error) => {
@@ -120,11 +318,65 @@ document.addEventListener("DOMContentLoaded", function () {
     responseText.textContent = text;
   }
 
+  function playResponse(audioUrl) {
+    if (!audioUrl) {
+      return;
+    }
+    new Audio(audioUrl).play().catch((error) => {
+      console.error("Error playing response:", error);
+    });
+  }
+
+  function lineKey(item) {
+    return JSON.stringify([
+      item.name,
+      item.brand || null,
+      item.type || null,
+      !!item.organic,
+    ]);
+  }
+
+  function applyListUpdate(data) {
+    // Responses can arrive out of order; never go back to an older version.
+    if (listVersion !== null && data.version < listVersion) {
+      return;
+    }
+    if (data.shopping_list) {
+      listItems.clear();
+      data.shopping_list.forEach((item) => listItems.set(lineKey(item), item));
+    } else {
+      data.removed.forEach((item) => listItems.delete(lineKey(item)));
+      data.changed
+        .concat(data.added)
+        .forEach((item) => listItems.set(lineKey(item), item));
+    }
+    listVersion = data.version;
+    renderShoppingList(Array.from(listItems.values()));
+  }
+
+  function watchShoppingList() {
+    // Pushes changes made elsewhere (other tabs, voice jobs) as they happen.
+    // Each open stream holds a server thread, so the server has to opt in;
+    // otherwise the list is refreshed when the page regains focus.
+    if (document.body.dataset.liveSync !== "1" || !window.EventSource || listEvents) {
+      return;
+    }
+    listEvents = new EventSource(`/shopping-list/events?since=${listVersion}`);
+    listEvents.addEventListener("list", (event) => {
+      applyListUpdate(JSON.parse(event.data));
+    });
+  }
+
   function loadShoppingList() {
-    fetch("/shopping-list")
+    const url =
+      listVersion === null
+        ? "/shopping-list"
+        : `/shopping-list?since=${listVersion}`;
+    fetch(url)
       .then((response) => response.json())
       .then((data) => {
-        renderShoppingList(data.shopping_list);
+        applyListUpdate(data);
+        watchShoppingList();
       })
       .catch((error) => {
         console.error("Error loading shopping list:", error);
@@ -0,0 +1,551 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from locks import StripedLock
+from metrics import timed
+from persistence import (apply_record, new_user, upgrade_user, bump_item_stats, HISTORY_LIMIT,
+                         TOMBSTONE_LIMIT)
+
+# Storage backends for per-user state (shopping lists, history, preferences).
+# The product catalog stays in shopping_data.json; only user data lives here.
+
+# How often wait_for_list_change re-reads the version, which is how it sees
+# changes made by other processes.
+LIST_POLL_SECONDS = float(os.environ.get('LIST_POLL_SECONDS', '1'))
+
+
+class Storage:
+    def __init__(self):
+        self._list_changed = threading.Condition()
+
+    def ensure_user(self, user_id):
+        raise NotImplementedError
+
+    def user_ids(self):
+        raise NotImplementedError
+
+    def get_shopping_list(self, user_id):
+        raise NotImplementedError
+
+    def add_item(self, user_id, item):
+        """Add item, merging into an existing line with the same variant.
+
+        Returns (line, merged).
+        """
+        raise NotImplementedError
+
+    def remove_item(self, user_id, name):
+        """Remove every variant of name; returns the removed lines."""
+        raise NotImplementedError
+
+    def clear_list(self, user_id):
+        raise NotImplementedError
+
+    def add_history(self, user_id, item):
+        raise NotImplementedError
+
+    def get_history(self, user_id, limit=None):
+        """Recent purchases, oldest first; only the last HISTORY_LIMIT are kept."""
+        raise NotImplementedError
+
+    def get_item_stats(self, user_id):
+        """Per-item purchase totals for the user's whole history, by name."""
+        raise NotImplementedError
+
+    def batch(self, user_id):
+        """Context manager making the enclosed mutations one atomic write."""
+        raise NotImplementedError
+
+    def get_list_version(self, user_id):
+        """Bumped by every change to the user's list."""
+        raise NotImplementedError
+
+    def get_versioned_list(self, user_id):
+        """(version, lines), read consistently."""
+        raise NotImplementedError
+
+    def get_list_changes(self, user_id, since):
+        """{'version', 'added', 'changed', 'removed'} since version since.
+
+        Removed lines are given as their variant (name, brand, type, organic).
+        Returns None when since is too old to answer; send the full list.
+        """
+        raise NotImplementedError
+
+    def _notify_list_changed(self):
+        with self._list_changed:
+            self._list_changed.notify_all()
+
+    def wait_for_list_change(self, user_id, version, timeout):
+        """Block until the list version differs from version; returns the current one."""
+        deadline = time.monotonic() + timeout
+        while True:
+            current = self.get_list_version(user_id)
+            remaining = deadline - time.monotonic()
+            if current != version or remaining <= 0:
+                return current
+            with self._list_changed:
+                self._list_changed.wait(min(remaining, LIST_POLL_SECONDS))
+
+
+class MemoryStorage(Storage):
+    """Dict-backed storage, optionally journaled through a WriteAheadLog."""
+
+    def __init__(self, data=None, wal=None):
+        super().__init__()
+        self.wal = wal
+        if wal is not None:
+            self.data = wal.data
+            self.locks = wal.locks
+        else:
+            self.data = data if data is not None else {}
+            self.locks = StripedLock()
+        self.data.setdefault('users', {})
+
+    def _apply(self, op, **fields):
+        if self.wal is not None:
+            return self.wal.record(op, **fields)
+        with self.locks.lock_for(fields['user']):
+            return apply_record(self.data, dict(fields, op=op))
+
+    def _user(self, user_id):
+        user = self.data['users'].get(user_id)
+        return upgrade_user(user) if user is not None else new_user()
+
+    @timed('storage')
+    def ensure_user(self, user_id):
+        if user_id not in self.data['users']:
+            self._apply('init_user', user=user_id)
+
+    def user_ids(self):
+        return list(self.data['users'])
+
+    @timed('storage')
+    def get_shopping_list(self, user_id):
+        # Lines are replaced, never mutated, so a shallow copy is a consistent view.
+        with self.locks.lock_for(user_id):
+            return list(self._user(user_id)['shopping_list'])
+
+    @timed('storage')
+    def add_item(self, user_id, item):
+        line = self._apply('add_item', user=user_id, item=item)
+        self._notify_list_changed()
+        return line, line is not item
+
+    @timed('storage')
+    def remove_item(self, user_id, name):
+        with self.locks.lock_for(user_id):
+            # Don't journal removes that match nothing.
+            if name not in self._user(user_id)['shopping_list'].by_name:
+                return []
+            removed = self._apply('remove_name', user=user_id, name=name)
+        self._notify_list_changed()
+        return removed
+
+    @timed('storage')
+    def clear_list(self, user_id):
+        self._apply('clear_list', user=user_id)
+        self._notify_list_changed()
+
+    @timed('storage')
+    def add_history(self, user_id, item):
+        self._apply('add_history', user=user_id, item=item)
+
+    @timed('storage')
+    def get_history(self, user_id, limit=None):
+        with self.locks.lock_for(user_id):
+            history = self._user(user_id)['history']
+            return history[-limit:] if limit else list(history)
+
+    @timed('storage')
+    def get_item_stats(self, user_id):
+        with self.locks.lock_for(user_id):
+            return dict(self._user(user_id)['item_stats'])
+
+    def batch(self, user_id):
+        if self.wal is not None:
+            return self.wal.batch(user_id)
+        return self.locks.lock_for(user_id)
+
+    @timed('storage')
+    def get_list_version(self, user_id):
+        with self.locks.lock_for(user_id):
+            return self._user(user_id)['shopping_list'].version
+
+    @timed('storage')
+    def get_versioned_list(self, user_id):
+        with self.locks.lock_for(user_id):
+            shopping_list = self._user(user_id)['shopping_list']
+            return shopping_list.version, list(shopping_list)
+
+    @timed('storage')
+    def get_list_changes(self, user_id, since):
+        with self.locks.lock_for(user_id):
+            return self._user(user_id)['shopping_list'].changes_since(since)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    preferences TEXT NOT NULL DEFAULT '{}',
+    list_version INTEGER NOT NULL DEFAULT 0,
+    removed_floor INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS list_items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    brand TEXT NOT NULL DEFAULT '',
+    type TEXT NOT NULL DEFAULT '',
+    organic INTEGER NOT NULL DEFAULT 0,
+    quantity INTEGER NOT NULL,
+    category TEXT,
+    price REAL,
+    added_on TEXT,
+    added_version INTEGER NOT NULL DEFAULT 0,
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE UNIQUE INDEX IF NOT EXISTS list_items_variant
+    ON list_items (user_id, name, brand, type, organic);
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    item TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS history_user ON history (user_id, id);
+CREATE TABLE IF NOT EXISTS list_removals (
+    user_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    brand TEXT NOT NULL,
+    type TEXT NOT NULL,
+    organic INTEGER NOT NULL,
+    version INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS list_removals_user ON list_removals (user_id, version);
+CREATE TABLE IF NOT EXISTS item_stats (
+    user_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    quantity INTEGER NOT NULL,
+    last_bought TEXT,
+    avg_interval REAL,
+    PRIMARY KEY (user_id, name)
+);
+"""
+
+# Columns added since the tables were first created, for older databases.
+MIGRATIONS = {
+    'users': [('list_version', 'INTEGER NOT NULL DEFAULT 0'),
+              ('removed_floor', 'INTEGER NOT NULL DEFAULT 0')],
+    'list_items': [('added_version', 'INTEGER NOT NULL DEFAULT 0'),
+                   ('version', 'INTEGER NOT NULL DEFAULT 0')],
+}
+
+ITEM_COLUMNS = "name, brand, type, organic, quantity, category, price, added_on"
+STATS_COLUMNS = ('count', 'quantity', 'last_bought', 'avg_interval')
+
+
+def _row_to_item(row):
+    name, brand, item_type, organic, quantity, category, price, added_on = row
+    item = {
+        'name': name,
+        'quantity': quantity,
+        'category': category,
+        'added_on': added_on,
+        'brand': brand or None,
+        'type': item_type or None,
+        'organic': bool(organic)
+    }
+    if price is not None:
+        item['price'] = price
+    return item
+
+
+def _variant(item):
+    # NULLs never collide in a UNIQUE index, so store missing variants as ''.
+    return (item['name'], item.get('brand') or '', item.get('type') or '',
+            int(bool(item.get('organic'))))
+
+
+def _row_to_variant(row):
+    name, brand, item_type, organic = row
+    return {'name': name, 'brand': brand or None, 'type': item_type or None,
+            'organic': bool(organic)}
+
+
+class SQLiteStorage(Storage):
+    """Shared storage for multiple workers, one connection per thread."""
+
+    def __init__(self, path, legacy_users=None):
+        super().__init__()
+        self.path = path
+        self._local = threading.local()
+        self._known_users = set()
+
+        conn = self._conn()
+        with conn:
+            conn.executescript(SCHEMA)
+            self._migrate(conn)
+        if legacy_users and not conn.execute("SELECT 1 FROM users LIMIT 1").fetchone():
+            self.import_users(legacy_users)
+        elif not conn.execute("SELECT 1 FROM item_stats LIMIT 1").fetchone():
+            self._backfill_stats()
+
+    def _migrate(self, conn):
+        for table, columns in MIGRATIONS.items():
+            existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+            for column, definition in columns:
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        conn.execute("CREATE INDEX IF NOT EXISTS list_items_version "
+                     "ON list_items (user_id, version)")
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self, mode='IMMEDIATE'):
+        # Reads that span several queries use mode='DEFERRED' for a consistent
+        # snapshot without taking the write lock.
+        conn = self._conn()
+        if getattr(self._local, 'depth', 0):
+            # Already inside batch(): join the outer transaction.
+            self._local.depth += 1
+            try:
+                yield conn
+            finally:
+                self._local.depth -= 1
+            return
+
+        conn.execute(f"BEGIN {mode}")
+        self._local.depth = 1
+        self._local.list_changed = False
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            self._local.depth = 0
+        # Waiters are only woken once the change is visible to them.
+        if self._local.list_changed:
+            self._notify_list_changed()
+
+    def batch(self, user_id):
+        return self._transaction()
+
+    def import_users(self, users):
+        with self._transaction() as conn:
+            for user_id, user in users.items():
+                conn.execute("INSERT OR IGNORE INTO users (user_id, preferences) VALUES (?, ?)",
+                             (user_id, json.dumps(user.get('preferences', {}))))
+                for item in user.get('shopping_list', []):
+                    self._upsert(conn, user_id, item)
+                for item in user.get('history', []):
+                    self._record_history(conn, user_id, item)
+
+    @timed('storage')
+    def ensure_user(self, user_id):
+        if user_id in self._known_users:
+            return
+        conn = self._conn()
+        conn.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (user_id,))
+        self._known_users.add(user_id)
+
+    def user_ids(self):
+        return [row[0] for row in self._conn().execute("SELECT user_id FROM users")]
+
+    @timed('storage')
+    def get_shopping_list(self, user_id):
+        rows = self._conn().execute(
+            f"SELECT {ITEM_COLUMNS} FROM list_items WHERE user_id = ? ORDER BY id",
+            (user_id,))
+        return [_row_to_item(row) for row in rows]
+
+    def _bump_version(self, conn, user_id):
+        conn.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (user_id,))
+        conn.execute("UPDATE users SET list_version = list_version + 1 WHERE user_id = ?",
+                     (user_id,))
+        self._local.list_changed = True
+        return conn.execute("SELECT list_version FROM users WHERE user_id = ?",
+                            (user_id,)).fetchone()[0]
+
+    def _upsert(self, conn, user_id, item, version=0):
+        row = conn.execute(
+            "SELECT id, quantity FROM list_items "
+            "WHERE user_id = ? AND name = ? AND brand = ? AND type = ? AND organic = ?",
+            (user_id,) + _variant(item)).fetchone()
+        if row:
+            conn.execute("UPDATE list_items SET quantity = ?, version = ? WHERE id = ?",
+                         (row[1] + item['quantity'], version, row[0]))
+            return row[0], True
+        cur = conn.execute(
+            f"INSERT INTO list_items (user_id, {ITEM_COLUMNS}, added_version, version) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (user_id,) + _variant(item) + (item['quantity'], item.get('category'),
+                                           item.get('price'), item.get('added_on'),
+                                           version, version))
+        if version:
+            conn.execute(
+                "DELETE FROM list_removals "
+                "WHERE user_id = ? AND name = ? AND brand = ? AND type = ? AND organic = ?",
+                (user_id,) + _variant(item))
+        return cur.lastrowid, False
+
+    def _remove_lines(self, conn, user_id, where, params):
+        # Tombstone the lines for delta sync, then delete them.
+        version = self._bump_version(conn, user_id)
+        conn.execute(
+            "INSERT INTO list_removals (user_id, name, brand, type, organic, version) "
+            "SELECT user_id, name, brand, type, organic, ? FROM list_items "
+            f"WHERE {where} ORDER BY id", (version,) + params)
+        conn.execute(f"DELETE FROM list_items WHERE {where}", params)
+        row = conn.execute(
+            "SELECT version FROM list_removals WHERE user_id = ? "
+            "ORDER BY version DESC LIMIT 1 OFFSET ?", (user_id, TOMBSTONE_LIMIT)).fetchone()
+        if row:
+            conn.execute("DELETE FROM list_removals WHERE user_id = ? AND version <= ?",
+                         (user_id, row[0]))
+            conn.execute("UPDATE users SET removed_floor = MAX(removed_floor, ?) WHERE user_id = ?",
+                         (row[0], user_id))
+
+    @timed('storage')
+    def add_item(self, user_id, item):
+        with self._transaction() as conn:
+            version = self._bump_version(conn, user_id)
+            row_id, merged = self._upsert(conn, user_id, item, version)
+            row = conn.execute(f"SELECT {ITEM_COLUMNS} FROM list_items WHERE id = ?",
+                               (row_id,)).fetchone()
+        return _row_to_item(row), merged
+
+    @timed('storage')
+    def remove_item(self, user_id, name):
+        with self._transaction() as conn:
+            rows = conn.execute(
+                f"SELECT {ITEM_COLUMNS} FROM list_items WHERE user_id = ? AND name = ? "
+                "ORDER BY id", (user_id, name)).fetchall()
+            if rows:
+                self._remove_lines(conn, user_id, "user_id = ? AND name = ?", (user_id, name))
+        return [_row_to_item(row) for row in rows]
+
+    @timed('storage')
+    def clear_list(self, user_id):
+        with self._transaction() as conn:
+            if conn.execute("SELECT 1 FROM list_items WHERE user_id = ? LIMIT 1",
+                            (user_id,)).fetchone():
+                self._remove_lines(conn, user_id, "user_id = ?", (user_id,))
+
+    @timed('storage')
+    def get_list_version(self, user_id):
+        row = self._conn().execute("SELECT list_version FROM users WHERE user_id = ?",
+                                   (user_id,)).fetchone()
+        return row[0] if row else 0
+
+    @timed('storage')
+    def get_versioned_list(self, user_id):
+        with self._transaction('DEFERRED') as conn:
+            row = conn.execute("SELECT list_version FROM users WHERE user_id = ?",
+                               (user_id,)).fetchone()
+            rows = conn.execute(
+                f"SELECT {ITEM_COLUMNS} FROM list_items WHERE user_id = ? ORDER BY id",
+                (user_id,)).fetchall()
+        return (row[0] if row else 0), [_row_to_item(row) for row in rows]
+
+    @timed('storage')
+    def get_list_changes(self, user_id, since):
+        with self._transaction('DEFERRED') as conn:
+            row = conn.execute("SELECT list_version, removed_floor FROM users WHERE user_id = ?",
+                               (user_id,)).fetchone()
+            version, floor = row or (0, 0)
+            if since > version or since < floor:
+                return None
+            added, changed = [], []
+            for row in conn.execute(
+                    f"SELECT added_version, {ITEM_COLUMNS} FROM list_items "
+                    "WHERE user_id = ? AND version > ? ORDER BY id", (user_id, since)):
+                (added if row[0] > since else changed).append(_row_to_item(row[1:]))
+            removed = [_row_to_variant(row) for row in conn.execute(
+                "SELECT name, brand, type, organic FROM list_removals "
+                "WHERE user_id = ? AND version > ? ORDER BY version, rowid", (user_id, since))]
+        return {'version': version, 'added': added, 'changed': changed, 'removed': removed}
+
+    def _backfill_stats(self):
+        # Databases created before item_stats existed: roll up their full
+        # history once, then cap it.
+        with self._transaction() as conn:
+            rows = conn.execute("SELECT user_id, item FROM history ORDER BY id").fetchall()
+            stats = {}
+            for user_id, item in rows:
+                item = json.loads(item)
+                key = (user_id, item['name'])
+                stats[key] = bump_item_stats(stats.get(key), item)
+            for (user_id, name), entry in stats.items():
+                self._put_stats(conn, user_id, name, entry)
+            for user_id in {user_id for user_id, _ in stats}:
+                self._trim_history(conn, user_id)
+
+    def _put_stats(self, conn, user_id, name, stats):
+        conn.execute(
+            "INSERT OR REPLACE INTO item_stats "
+            "(user_id, name, count, quantity, last_bought, avg_interval) VALUES (?, ?, ?, ?, ?, ?)",
+            (user_id, name, stats['count'], stats['quantity'], stats['last_bought'],
+             stats['avg_interval']))
+
+    def _trim_history(self, conn, user_id):
+        conn.execute(
+            "DELETE FROM history WHERE user_id = ? AND id <= "
+            "(SELECT id FROM history WHERE user_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+            (user_id, user_id, HISTORY_LIMIT))
+
+    def _record_history(self, conn, user_id, item):
+        conn.execute("INSERT INTO history (user_id, name, item) VALUES (?, ?, ?)",
+                     (user_id, item['name'], json.dumps(item)))
+        self._trim_history(conn, user_id)
+        row = conn.execute(
+            "SELECT count, quantity, last_bought, avg_interval FROM item_stats "
+            "WHERE user_id = ? AND name = ?", (user_id, item['name'])).fetchone()
+        stats = dict(zip(STATS_COLUMNS, row)) if row else None
+        self._put_stats(conn, user_id, item['name'], bump_item_stats(stats, item))
+
+    @timed('storage')
+    def add_history(self, user_id, item):
+        with self._transaction() as conn:
+            self._record_history(conn, user_id, item)
+
+    @timed('storage')
+    def get_history(self, user_id, limit=None):
+        query = "SELECT item FROM history WHERE user_id = ? ORDER BY id DESC"
+        params = (user_id,)
+        if limit:
+            query += " LIMIT ?"
+            params += (limit,)
+        rows = self._conn().execute(query, params).fetchall()
+        return [json.loads(row[0]) for row in reversed(rows)]
+
+    @timed('storage')
+    def get_item_stats(self, user_id):
+        rows = self._conn().execute(
+            "SELECT name, count, quantity, last_bought, avg_interval FROM item_stats "
+            "WHERE user_id = ?", (user_id,))
+        return {row[0]: dict(zip(STATS_COLUMNS, row[1:])) for row in rows}
+
+
+def create_storage(backend, data, wal=None, sqlite_path='data/shopping.db'):
+    if backend == 'sqlite':
+        return SQLiteStorage(sqlite_path, legacy_users=data.get('users'))
+    if backend == 'memory':
+        return MemoryStorage(data, wal=wal)
+    raise ValueError(f"Unknown storage backend: {backend}")
@@ -0,0 +1,74 @@
+from datetime import date
+from collections import namedtuple
+
+# Everything generate_suggestions and check_for_sales need that does not
+# depend on the user, computed once and rebuilt only when the catalog version,
+# the sales or the date changes, so a suggestion costs a few dict lookups.
+
+SEASONS = {12: 'winter', 1: 'winter', 2: 'winter',
+           3: 'spring', 4: 'spring', 5: 'spring',
+           6: 'summer', 7: 'summer', 8: 'summer',
+           9: 'fall', 10: 'fall', 11: 'fall'}
+
+Snapshot = namedtuple('Snapshot', [
+    'key',               # (catalog version, sales version, day) it was built for
+    'season',
+    'seasonal_items',    # names for the current season
+    'sales',             # item name -> sale, only sales that have not expired
+    'sale_suggestions',  # "<item> (on sale!)" for each active sale
+    'category_names',    # category -> product names in catalog order
+])
+
+
+def season_for(day):
+    return SEASONS[day.month]
+
+
+def sale_active(sale, day):
+    until = sale.get('until')
+    if not until:
+        return True
+    try:
+        return date.fromisoformat(until) >= day
+    except ValueError:
+        print(f"Ignoring invalid sale end date: {until}")
+        return True
+
+
+class SuggestionContext:
+    def __init__(self, data, catalog):
+        self.data = data
+        self.catalog = catalog
+        self.sales_version = 0
+        self._snapshot = None
+
+    def invalidate(self):
+        """Call after shopping_data['sales'] or the seasonal items change."""
+        self.sales_version += 1
+
+    def get(self, today=None):
+        today = today or date.today()
+        key = (self.catalog.version, self.sales_version, today)
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.key != key:
+            snapshot = self._snapshot = self._build(key, today)
+        return snapshot
+
+    def _build(self, key, today):
+        season = season_for(today)
+        sales = {}
+        for sale in self.data.get('sales', {}).get('current', []):
+            if sale_active(sale, today):
+                sales.setdefault(sale['item'], sale)
+        category_names = {
+            category: [item['name'] if isinstance(item, dict) else item for item in items]
+            for category, items in self.data.get('products', {}).items()
+        }
+        return Snapshot(
+            key=key,
+            season=season,
+            seasonal_items=tuple(self.data.get('seasonal_items', {}).get(season, [])),
+            sales=sales,
+            sale_suggestions=tuple(f"{name} (on sale!)" for name in sales),
+            category_names=category_names,
+        )
@@ -0,0 +1,187 @@
+import io
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Two-tier (memory + disk) LRU cache of synthesized speech, keyed by a hash of
+# (text, lang, voice). Clips are served to the browser by key rather than
+# being played on the server.
+
+TTS_MEMORY_BYTES = int(os.environ.get('TTS_MEMORY_BYTES', str(16 * 1024 * 1024)))
+TTS_DISK_BYTES = int(os.environ.get('TTS_DISK_BYTES', str(256 * 1024 * 1024)))
+TTS_CACHE_DIR = os.environ.get('TTS_CACHE_DIR', os.path.join('audio', 'cache'))
+MAX_PENDING_REQUESTS = 4096
+TTS_ENGINE = os.environ.get('TTS_ENGINE', 'gtts')
+
+# One silent MPEG-1 Layer III frame (128 kbps, 44.1 kHz).
+SILENT_MP3_FRAME = b'\xff\xfb\x90\x00' + b'\x00' * 413
+
+
+def synthesize(text, lang='en', voice='com'):
+    # Imported on first use so workers that never speak don't load it.
+    from gtts import gTTS
+    buf = io.BytesIO()
+    gTTS(text=text, lang=lang, tld=voice).write_to_fp(buf)
+    return buf.getvalue()
+
+
+def synthesize_stub(text, lang='en', voice='com'):
+    """Offline stand-in for tests and benchmarks: silence, longer for longer text."""
+    return SILENT_MP3_FRAME * max(1, len(text) // 16)
+
+
+SYNTHESIZERS = {
+    'gtts': synthesize,
+    'stub': synthesize_stub,
+}
+
+
+class TTSCache:
+    def __init__(self, directory=TTS_CACHE_DIR, memory_bytes=TTS_MEMORY_BYTES,
+                 disk_bytes=TTS_DISK_BYTES, synthesizer=None):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.synthesizer = synthesizer or SYNTHESIZERS[TTS_ENGINE]
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()   # key -> mp3 bytes
+        self._memory_size = 0
+        self._disk = OrderedDict()     # key -> file size
+        self._disk_size = 0
+        self._requests = OrderedDict() # key -> (text, lang, voice) for lazy synthesis
+        self._inflight = {}            # key -> Event set when synthesis finishes
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0}
+
+        os.makedirs(directory, exist_ok=True)
+        entries = []
+        for filename in os.listdir(directory):
+            if filename.endswith('.mp3'):
+                stat = os.stat(os.path.join(directory, filename))
+                entries.append((stat.st_mtime, filename[:-4], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_size += size
+
+    @staticmethod
+    def key(text, lang='en', voice='com'):
+        return hashlib.sha256(f"{lang}\0{voice}\0{text}".encode('utf-8')).hexdigest()[:32]
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.mp3')
+
+    def register(self, text, lang='en', voice='com'):
+        """Remember how to synthesize key, so it can be produced on first fetch."""
+        key = self.key(text, lang, voice)
+        with self._lock:
+            if key not in self._memory and key not in self._disk:
+                self._requests[key] = (text, lang, voice)
+                if len(self._requests) > MAX_PENDING_REQUESTS:
+                    self._requests.popitem(last=False)
+        return key
+
+    def get(self, key):
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.counters['memory_hits'] += 1
+                return data
+            indexed = key in self._disk
+            if indexed:
+                self._disk.move_to_end(key)
+
+        # Also look for files this process has not indexed: other workers
+        # share the directory and write clips of their own.
+        try:
+            with open(self._path(key), 'rb') as f:
+                data = f.read()
+        except OSError:
+            data = None
+        with self._lock:
+            if data is not None:
+                if key not in self._disk:
+                    self._disk[key] = len(data)
+                    self._disk_size += len(data)
+                self.counters['disk_hits'] += 1
+                self._store_memory(key, data)
+                return data
+            if indexed and key in self._disk:
+                # Evicted by another worker.
+                self._disk_size -= self._disk.pop(key)
+            self.counters['misses'] += 1
+        return None
+
+    def put(self, key, data):
+        path = self._path(key)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._requests.pop(key, None)
+            self._store_memory(key, data)
+            if key in self._disk:
+                self._disk_size -= self._disk.pop(key)
+            self._disk[key] = len(data)
+            self._disk_size += len(data)
+            evicted = []
+            while self._disk_size > self.disk_bytes and len(self._disk) > 1:
+                old_key, size = self._disk.popitem(last=False)
+                self._disk_size -= size
+                evicted.append(old_key)
+                self.counters['evictions'] += 1
+
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
+
+    def _store_memory(self, key, data):
+        if key in self._memory:
+            self._memory_size -= len(self._memory.pop(key))
+        self._memory[key] = data
+        self._memory_size += len(data)
+        while self._memory_size > self.memory_bytes and len(self._memory) > 1:
+            _, old = self._memory.popitem(last=False)
+            self._memory_size -= len(old)
+
+    def synthesize_key(self, key):
+        """Return the clip for a registered key, synthesizing it on a miss."""
+        data = self.get(key)
+        if data is not None:
+            return data
+        with self._lock:
+            request = self._requests.get(key)
+            if request is None:
+                return None
+            event = self._inflight.get(key)
+            owner = event is None
+            if owner:
+                event = self._inflight[key] = threading.Event()
+
+        if not owner:
+            # Someone else is already synthesizing this clip; share the result.
+            event.wait()
+            return self.get(key)
+        try:
+            data = self.synthesizer(*request)
+            self.put(key, data)
+            return data
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            event.set()
+
+    def get_or_synthesize(self, text, lang='en', voice='com'):
+        key = self.register(text, lang, voice)
+        return key, self.synthesize_key(key)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters,
+                        memory_entries=len(self._memory), memory_bytes=self._memory_size,
+                        disk_entries=len(self._disk), disk_bytes=self._disk_size)